@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import pygame as G
+import metrics
 
 def vwfscan_at(pxa, xt, yt, tw, sepColor):
     """Scan along a scanline for pixels other than the separator color.
@@ -57,6 +58,7 @@ class PyGtxt(object):
             srcarea = G.rect.Rect(charnum * self.cw, rownum * self.ch,
                                   cw, self.ch)
             dstSurface.blit(self.img, (x, y), srcarea)
+            metrics.enabled and metrics.add('blit.textout')
             x += cw
         return (startx, y, x - startx, self.ch)        
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Find objects near a point without testing every object.
+
+A SpatialGrid puts each object in the bucket for the 16x16 pixel
+cell of the 16x12 cell playfield that its pos falls in.  A query
+for a rectangle looks only in the buckets that the rectangle
+touches.  Callers still do their own exact test on what a query
+returns, so using the grid never changes which objects collide,
+only how many are tested.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+
+class SpatialGrid(object):
+    """Objects with a pos, bucketed by cell.
+
+Objects above, below, left, or right of the playfield go in the
+nearest cell on the edge, and queries are clamped the same way.
+With no more than small_count objects, bucketing costs more than
+it saves, so query() returns them all.
+
+"""
+    small_count = 8
+
+    def __init__(self, cols=16, rows=12, cellsize=16):
+        self.cols, self.rows, self.cellsize = cols, rows, cellsize
+        self.buckets = [[] for i in range(cols * rows)]
+        self.objs = []
+        self.used = []
+
+    def rebuild(self, objs):
+        """Bucket the objects in objs that have a pos."""
+        buckets = self.buckets
+        for i in self.used:
+            del buckets[i][:]
+        del self.used[:]
+        self.objs = objs = [obj for obj in objs if obj and obj.pos]
+        if len(objs) <= self.small_count:
+            return
+        cols, lastcol, lastrow = self.cols, self.cols - 1, self.rows - 1
+        cellsize, used = self.cellsize, self.used
+        for seq, obj in enumerate(objs):
+            x, y = obj.pos
+            col = min(lastcol, max(0, int(x // cellsize)))
+            row = min(lastrow, max(0, int(y // cellsize)))
+            bucket = buckets[row * cols + col]
+            if not bucket:
+                used.append(row * cols + col)
+            bucket.append((seq, obj))
+
+    def query(self, left, top, right, bottom):
+        """Return objects whose cell touches a rectangle, in the order
+they were passed to rebuild()."""
+        if len(self.objs) <= self.small_count:
+            return self.objs
+        cs = self.cellsize
+        lastcol, lastrow = self.cols - 1, self.rows - 1
+        l = min(lastcol, max(0, int(left // cs)))
+        r = min(lastcol, max(0, int(right // cs)))
+        t = min(lastrow, max(0, int(top // cs)))
+        b = min(lastrow, max(0, int(bottom // cs)))
+        buckets, cols = self.buckets, self.cols
+        found = []
+        for row in range(t * cols, b * cols + 1, cols):
+            for bucket in buckets[row + l:row + r + 1]:
+                if bucket:
+                    found.extend(bucket)
+        if len(found) > 1:
+            found.sort()  # seq is unique, so objects aren't compared
+        return [obj for (seq, obj) in found]
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 import pygame as G
+import hashlib, struct, sys
 from array import array
 from math import sin, pi
 from time import sleep
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 mixer_freq = 44100
 # 44100/60 = 735
@@ -114,6 +119,140 @@ def synth_noise_effect(snddata, samples_per_frame):
             out.append(level)
     return out
 
+# NumPy versions of the synths above, producing the same samples.
+# The period counter is a float whose rounding decides which sample
+# each phase step lands on, so _np_clock() steps it from one phase
+# change to the next with the same float operations as the sample
+# loops.  Everything else is done on whole arrays.
+
+def _np_clock(periods, samples_per_frame):
+    """Find the samples at which a channel's period counter runs out.
+
+periods holds one period per frame.  Return a bool array with one
+element per sample, True where the phase advances, and an array of
+the counter's value just before each of those advances.
+
+"""
+    fires = []
+    counts = []
+    periodcd = 0
+    s = 0
+    for period in periods:
+        end = s + samples_per_frame
+        while s < end:
+            if periodcd < 1:
+                fires.append(s)
+                counts.append(periodcd)
+                periodcd += period
+                periodcd -= 1
+                s += 1
+            else:
+                # Subtracting a whole number from a float that is at
+                # least 1 is exact, so this matches n decrements by 1
+                n = min(int(periodcd), end - s)
+                periodcd -= n
+                s += n
+    fire = np.zeros(s, dtype=bool)
+    fire[fires] = True
+    return fire, np.array(counts, dtype=float)
+
+def _np_box_filter(level, fire, counts, oldlevel):
+    """Blend the old and new level on samples where the phase advances.
+
+level is the level after each sample's phase change, and oldlevel is
+the level before it on each True sample of fire.
+
+"""
+    level2 = level[fire]
+    level[fire] = level2 + np.trunc(np.maximum(counts, 0)
+                                    * (oldlevel - level2)).astype(int)
+    return level
+
+def _np_pairs(snddata):
+    data = np.frombuffer(bytes(snddata), dtype=np.uint8).astype(int)
+    n = len(data) // 2
+    return data[0:2 * n:2], data[1:2 * n:2]
+
+def _np_to_array(samples):
+    out = array('h')
+    out.frombytes(samples.astype(np.int16).tobytes())
+    return out
+
+def np_synth_square_effect(snddata, samples_per_frame):
+    dutyvol, notes = _np_pairs(snddata)
+    fire, counts = _np_clock([notePeriods[n] for n in notes],
+                             samples_per_frame)
+    frame = np.repeat(np.arange(len(notes)), samples_per_frame)
+    duty = np.array([1, 2, 4, 6])[(dutyvol >> 6) & 0x03][frame]
+    vol = (1000 * (dutyvol & 0x0F))[frame]
+    phase = np.cumsum(fire) % 8
+    level = np.where(phase < duty, vol, 0)
+    oldlevel = np.where((phase[fire] - 1) % 8 < duty[fire], vol[fire], 0)
+    return _np_to_array(_np_box_filter(level, fire, counts, oldlevel))
+
+def np_synth_triangle_effect(snddata, samples_per_frame):
+    dutyvol, notes = _np_pairs(snddata)
+    fire, counts = _np_clock([notePeriods[n] / 2 for n in notes],
+                             samples_per_frame)
+    samples = np.arange(1000, 17000, 2000)
+    samples = np.concatenate([samples, samples[::-1]])
+    samples = np.concatenate([samples, -samples])
+    phase = np.cumsum(fire) % 32
+    level = samples[phase]
+    oldlevel = samples[(phase[fire] - 1) % 32]
+    out = _np_to_array(_np_box_filter(level, fire, counts, oldlevel))
+
+    # anti-pop
+    level = int(samples[phase[-1]] if len(phase) else samples[0])
+    out.extend(i * level // samples_per_frame
+               for i in range(samples_per_frame, 0, -1))
+    return out
+
+def _lfsr_bits(shiftreg, othertap, count):
+    """Clock the noise shift register count times.
+
+Return the new bits as a bool array and the new register value.
+
+"""
+    # bits holds the register's whole output stream, oldest bit
+    # first.  Each new bit is the XOR of the bits 15 and 15 - othertap
+    # places before it, so the last 15 bits make 15 - othertap more.
+    step = 15 - othertap
+    stepmask = (1 << step) - 1
+    bits = shiftreg
+    have = 15
+    while have < count + 15:
+        window = bits >> (have - 15)
+        bits |= ((window ^ (window >> othertap)) & stepmask) << have
+        have += step
+    newbits = (bits >> 15) & ((1 << count) - 1)
+    newbits = np.frombuffer(newbits.to_bytes(count // 8 + 1, 'little'),
+                            dtype=np.uint8)
+    newbits = np.unpackbits(newbits, bitorder='little')[:count]
+    return newbits.astype(bool), (bits >> count) & 0x7FFF
+
+def np_synth_noise_effect(snddata, samples_per_frame):
+    volbytes, dutyperiods = _np_pairs(snddata)
+    fire, counts = _np_clock([noisePeriods[d & 0x0F] for d in dutyperiods],
+                             samples_per_frame)
+    fires_per_frame = fire.reshape(-1, samples_per_frame).sum(axis=1)
+    shiftreg = 0x4321
+    newbits = []
+    for dutyperiod, count in zip(dutyperiods, fires_per_frame):
+        bits, shiftreg = _lfsr_bits(shiftreg, 6 if dutyperiod & 0x80 else 1,
+                                    int(count))
+        newbits.append(bits)
+    newbits = np.concatenate(newbits) if newbits else np.zeros(0, bool)
+
+    # because square sfx are positive polarity, make noise
+    # sfx negative
+    vol = -1000 * (volbytes & 0x0F)
+    vol = np.repeat(vol, fires_per_frame)
+    level2 = np.concatenate([[0], np.where(newbits, vol, 0)])
+    # between advances, hold the level set by the last one
+    level = level2[np.cumsum(fire)]
+    return _np_to_array(_np_box_filter(level, fire, counts, level2[:-1]))
+
 def synth_ding(f):
     f_trig = f * 2 * pi / mixer_freq
     length = mixer_freq // 2
@@ -123,16 +262,93 @@ def synth_ding(f):
                            * (length - t) / length))
                  for t in range(length)))
 
-def make_sound_effects(sfxdata):
+sound_bank_magic = b'FHBGsfx1'
+# Bump whenever a change to synth_*() or make_sound_effects() changes
+# the samples they produce, so that saved sound banks are rebuilt
+synth_version = 1
+sound_bank_entry = struct.Struct('<HI')
+
+def sound_bank_key(sfxdata):
+    """Hash everything that make_sound_effects() output depends on."""
+    h = hashlib.sha1(struct.pack('<II', synth_version, mixer_freq))
+    for (name, ch, framelen, data) in sfxdata:
+        name = name.encode('utf-8')
+        h.update(struct.pack('<HBBI', len(name), ch, framelen, len(data)))
+        h.update(name)
+        h.update(bytes(data))
+    return h.digest()
+
+def load_sound_bank(filename, key):
+    """Load effects saved by save_sound_bank(), or None if missing or stale."""
+    try:
+        with open(filename, 'rb') as infp:
+            data = infp.read()
+    except IOError:
+        return None
+    i = len(sound_bank_magic) + len(key)
+    if data[:i] != sound_bank_magic + key:
+        return None
+    sfx = {}
+    try:
+        while i < len(data):
+            namelen, numsamples = sound_bank_entry.unpack_from(data, i)
+            i += sound_bank_entry.size
+            name = data[i:i + namelen].decode('utf-8')
+            i += namelen
+            samples = array('h')
+            samples.frombytes(data[i:i + 2 * numsamples])
+            i += 2 * numsamples
+            if len(samples) != numsamples:
+                return None
+            if sys.byteorder != 'little':
+                samples.byteswap()
+            sfx[name] = samples
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return sfx
+
+def save_sound_bank(filename, key, sfx):
+    with open(filename, 'wb') as outfp:
+        outfp.write(sound_bank_magic)
+        outfp.write(key)
+        for name, samples in sfx.items():
+            name = name.encode('utf-8')
+            if sys.byteorder != 'little':
+                samples = array('h', samples)
+                samples.byteswap()
+            outfp.write(sound_bank_entry.pack(len(name), len(samples)))
+            outfp.write(name)
+            outfp.write(samples.tobytes())
+
+def make_sound_effects(sfxdata, cache_filename=None):
+    """Synthesize each effect in sfxdata.
+
+If cache_filename is given, load the effects from there if it was
+saved from the same sfxdata, mixer_freq, and synth_version, or else
+save them there.
+
+"""
+    if cache_filename:
+        key = sound_bank_key(sfxdata)
+        sfx = load_sound_bank(cache_filename, key)
+        if sfx is not None:
+            return sfx
+    if np is not None:
+        synths = (np_synth_square_effect, np_synth_triangle_effect,
+                  np_synth_noise_effect)
+    else:
+        synths = (synth_square_effect, synth_triangle_effect,
+                  synth_noise_effect)
     baselen = mixer_freq // 60
     sfx = {}
     for (name, ch, framelen, data) in sfxdata:
-        synth = (synth_noise_effect
-                 if ch >= 12
-                 else synth_triangle_effect
-                 if ch >= 8
-                 else synth_square_effect)
+        synth = synths[2 if ch >= 12 else 1 if ch >= 8 else 0]
         sfx[name] = synth(data, framelen*baselen)
+    if cache_filename:
+        try:
+            save_sound_bank(cache_filename, key, sfx)
+        except IOError as e:
+            print("%s: %s" % (cache_filename, e), file=sys.stderr)
     return sfx
 
 queued_fx = []
@@ -145,17 +361,37 @@ def fxq_play(sfx, logtime):
     if not queued_fx:
         return
     logged_fx.append((logtime, list(queued_fx)))
-    for sndname in queued_fx:
-        sfx[sndname].play()
+    if sfx:
+        for sndname in queued_fx:
+            sfx[sndname].play()
+    queued_fx[:] = []
+
+def fxq_clear():
+    """Drop queued sound effects without playing or logging them."""
     queued_fx[:] = []
 
 def mixer_add2(dst, src, t):
-    d = array(b'h', (min(32765, max(-32765, a + b))
-                     for a, b in zip(src, dst[t:t + len(src)])))
+    d = array('h', (min(32765, max(-32765, a + b))
+                    for a, b in zip(src, dst[t:t + len(src)])))
     dst[t:t + len(d)] = d
 
-def render_logged_fx(sfxdata, num_frames):
-    import sys
+def np_mixer_add2(dst, src, t):
+    """Add src to dst at t, saturating like mixer_add2()."""
+    src = src[:len(dst) - t]
+    d = dst[t:t + len(src)]
+    np.clip(d + src, -32765, 32765, out=d)
+
+def render_logged_fx(sfxdata, num_frames, filename='atee.wav',
+                     block_frames=60):
+    """Mix the effects in logged_fx into a WAV file.
+
+The output is written block_frames frames at a time, so memory use
+depends on the block size and the number of effects, not on the
+length of the recording.
+
+"""
+    import wave
+    from contextlib import closing
 
     # Don't play identical FX on the same frame.
     next_t_per_fx = {}
@@ -166,27 +402,57 @@ def render_logged_fx(sfxdata, num_frames):
             fxdeduped.append((new_t, fxname))
             next_t_per_fx[fxname] = new_t + 1
     new_t = fxlist = next_t_per_fx = None
-    
+
     sys.stdout.write("Rendering %d sound effects" % len(fxdeduped))
     sfx = make_sound_effects(sfxdata)
-    baselen = mixer_freq // 60
-    a = array(b'h', [0]) * (num_frames * baselen)
-    for t, fxname in fxdeduped:
-        sys.stdout.write('.')
-        mixer_add2(a, sfx.get(fxname, []), t * baselen)
-    sfx = fxdeduped = None
-
-    little = ord(array(b'h', [1]).tostring()[0])
-    if not little:
-        a.byteswap()
+    if np is not None:
+        sfx = dict((name, np.frombuffer(samples, dtype=np.int16)
+                          .astype(np.int32))
+                   for name, samples in sfx.items())
+        silence = np.zeros(0, dtype=np.int32)
+    else:
+        silence = array('h')
 
-    import wave
-    from contextlib import closing
-    with closing(wave.open('atee.wav', 'w')) as f:
+    # Saturation makes the order of mixing matter, so each block mixes
+    # effects in the same order as mixing the whole run at once would.
+    # pending is in start time order and active in fxdeduped order.
+    baselen = mixer_freq // 60
+    pending = sorted((t * baselen, seq, sfx.get(fxname, silence))
+                     for seq, (t, fxname) in enumerate(fxdeduped))
+    pending.reverse()
+    fxdeduped = None
+    active = []
+    total_len = num_frames * baselen
+    block_len = block_frames * baselen
+    with closing(wave.open(filename, 'w')) as f:
         f.setnchannels(1)
         f.setsampwidth(2)
         f.setframerate(mixer_freq)
-        f.writeframes(a.tostring())
+        for block_start in range(0, total_len, block_len):
+            block_end = min(total_len, block_start + block_len)
+            while pending and pending[-1][0] < block_end:
+                start, seq, samples = pending.pop()
+                active.append((seq, start, samples))
+                sys.stdout.write('.')
+            active.sort()
+            if np is not None:
+                a = np.zeros(block_end - block_start, dtype=np.int32)
+                mix = np_mixer_add2
+            else:
+                a = array('h', [0]) * (block_end - block_start)
+                mix = mixer_add2
+            for seq, start, samples in active:
+                skip = max(0, block_start - start)
+                mix(a, samples[skip:skip + len(a)],
+                    start + skip - block_start)
+            active = [x for x in active if x[1] + len(x[2]) > block_end]
+            if np is not None:
+                a = a.astype('<i2').tobytes()
+            else:
+                if sys.byteorder != 'little':
+                    a.byteswap()
+                a = a.tobytes()
+            f.writeframes(a)
     sys.stdout.write(" done.\n")
 
 splitsnd = array('B', [
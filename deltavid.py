@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Expand a delta video capture to raw video.
+
+usage: deltavid.py [-o OUTFILE] FILE
+
+During play, most of the screen stays the same from one frame to
+the next, and FHBGView.draw() already knows which rectangles
+changed.  A delta capture stores the first frame whole, then for
+each later frame only the pixels inside the rectangles that changed
+since the previous captured frame.  This cuts capture output by
+about an order of magnitude compared to raw video.
+
+The file starts with a header:
+
+    8 bytes: magic FHBGdlt1
+    uint16 width, uint16 height, uint8 bytes per pixel,
+    uint8 length of pixel format name
+    pixel format name as FFmpeg -pix_fmt, such as rgb24 or pal8
+
+Each frame is a uint16 count of rectangles, then for each rectangle
+uint16 left, top, width, height and its pixels row by row.  All
+numbers are little-endian.  A frame with no rectangles repeats the
+previous frame.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import struct
+
+magic = b'FHBGdlt1'
+headfmt = struct.Struct('<HHBB')
+countfmt = struct.Struct('<H')
+rectfmt = struct.Struct('<HHHH')
+
+class DeltaEncoder(object):
+    """Turn whole captured frames into delta frames.
+
+Call add_rects() after drawing each frame, whether or not it is
+captured, then encode() with each captured frame.
+
+"""
+    def __init__(self, width, height, pix_fmt):
+        self.width, self.height = width, height
+        self.pix_fmt = pix_fmt
+        self.rects = set()
+        self.full = True
+        self.header_sent = False
+        self.last_had_header = False
+
+    def add_rects(self, rects):
+        """Mark areas as changed, or the whole frame if rects is None."""
+        if rects is None:
+            self.full = True
+            return
+        w, h = self.width, self.height
+        for (l, t, rw, rh) in rects:
+            r, b = min(w, l + rw), min(h, t + rh)
+            l, t = max(0, l), max(0, t)
+            if l < r and t < b:
+                self.rects.add((l, t, r - l, b - t))
+
+    def encode(self, frame):
+        """Return a delta frame for the changed areas of frame.
+
+frame -- the whole frame, row by row, as from
+    Enlarger.capture_frame(); anything after the pixels, such as
+    an inline pal8 palette, is ignored
+
+"""
+        w, h = self.width, self.height
+        bpp = len(frame) // (w * h)
+        out = []
+        self.last_had_header = not self.header_sent
+        if not self.header_sent:
+            pix_fmt = self.pix_fmt.encode('ascii')
+            out.extend([magic, headfmt.pack(w, h, bpp, len(pix_fmt)), pix_fmt])
+            self.header_sent = True
+        rects = [(0, 0, w, h)] if self.full else sorted(self.rects)
+        self.rects.clear()
+        self.full = False
+        out.append(countfmt.pack(len(rects)))
+        frame = memoryview(frame)
+        pitch = w * bpp
+        for (l, t, rw, rh) in rects:
+            out.append(rectfmt.pack(l, t, rw, rh))
+            start = t * pitch + l * bpp
+            if rw == w:
+                out.append(frame[start:start + rh * pitch])
+            else:
+                out.extend(frame[i:i + rw * bpp]
+                           for i in range(start, start + rh * pitch, pitch))
+        return b''.join(out)
+
+    def dropped(self):
+        """Note that the last frame from encode() was not written.
+
+The next frame is then sent whole, as later deltas would otherwise
+apply to a base the decoder never saw, along with the header if
+the dropped frame carried it.
+
+"""
+        self.full = True
+        if self.last_had_header:
+            self.header_sent = False
+
+def read_header(infp):
+    """Read a delta capture's header.
+
+Return (width, height, bytes per pixel, pixel format name).
+
+"""
+    if infp.read(len(magic)) != magic:
+        raise ValueError("not a delta video capture")
+    w, h, bpp, namelen = headfmt.unpack(infp.read(headfmt.size))
+    return w, h, bpp, infp.read(namelen).decode('ascii')
+
+def decode_frames(infp):
+    """Read a delta capture and yield each frame as raw video.
+
+The same bytearray is updated and yielded for every frame.
+
+"""
+    w, h, bpp, pix_fmt = read_header(infp)
+    pitch = w * bpp
+    frame = bytearray(h * pitch)
+    while True:
+        data = infp.read(countfmt.size)
+        if len(data) < countfmt.size:
+            return
+        (count,) = countfmt.unpack(data)
+        for i in range(count):
+            l, t, rw, rh = rectfmt.unpack(infp.read(rectfmt.size))
+            rowlen = rw * bpp
+            pixels = infp.read(rowlen * rh)
+            if len(pixels) < rowlen * rh:
+                raise ValueError("delta video capture is truncated")
+            start = t * pitch + l * bpp
+            for y in range(rh):
+                i = start + y * pitch
+                frame[i:i + rowlen] = pixels[y * rowlen:(y + 1) * rowlen]
+        yield frame
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Expand a delta video capture to raw video.")
+    parser.add_argument('filename', help="delta capture, such as vtee.dlt")
+    parser.add_argument('-o', '--output', default='vtee.raw',
+                        help="raw video file to write (default vtee.raw)")
+    args = parser.parse_args(argv)
+    num_frames = 0
+    with open(args.filename, 'rb') as infp, open(args.output, 'wb') as outfp:
+        w, h, bpp, pix_fmt = read_header(infp)
+        infp.seek(0)
+        for frame in decode_frames(infp):
+            outfp.write(frame)
+            num_frames += 1
+    print("%s: %d frames, -pix_fmt %s -s %dx%d"
+          % (args.output, num_frames, pix_fmt, w, h))
+
+if __name__=='__main__':
+    main()
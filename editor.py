@@ -274,7 +274,7 @@ def editor(view, game, play_level):
             else:
                 es.level[3][:] = [e for e in es.level[3] if e]
                 connect_level(es.mapdata)
-                randomize_level_bg(es.mapdata)
+                randomize_level_bg(es.mapdata, game.rng)
                 game.new_game()
                 game.pf.sheet = view.metatile_sheet
 ##                with es:
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
+import metrics
 from chipsfx import fxq
+from entities import Pooled, compact
 from events import VK_A, VK_B, VK_UP, VK_DOWN, VK_LEFT, VK_RIGHT
-from loadlevel import MT_ELEVATOR_DOOR
+from loadlevel import MTF_BLOCK, MTF_LADDER, MTF_ELEVATOR_DOOR, MTF_FLOOR
 
 enemies_gfxcoords = {
     'plodder': (24, 64),
@@ -12,67 +14,62 @@ enemies_gfxcoords = {
     'toaster': (24, 80),
 }
 
+# Positions and velocities are integers in 1/PX pixel units, as an
+# NES game keeps a subpixel byte with each coordinate.  TILE is the
+# size of a 16-pixel cell in these units.
+PX = 256
+TILE = 16 * PX
+
+def to_pixels(v):
+    """Convert to whole pixels, rounding toward 0 as blit() does."""
+    return v // PX if v >= 0 else -(-v // PX)
+
 enemies_minitiles = {
     'sneaker': 0x12, 'spinner': 0x13, 'plodder': 0x14,
     'burger': 0x15, 'toaster': 0x16, 'pecker': 0x17,
     '': 0x08
 }
 
-def four_corner_collide(pf, x, y, rx, ry,
-                        with_downsolid=True, diag_corner_push=False):
-    tlx = int((x - 8) // 16)
-    tly = int((y - 8) // 16)
-    dx = x - (tlx + 1) * 16
-    dy = y - (tly + 1) * 16
-    if dy >= 0:  # already below centerline
-        with_downsolid = False
+def _four_corner_push(blks, insideblk, xside, yside, diag_corner_push,
+                      side_closer, right_of_diag, right_of_antidiag):
+    """Decide which way four_corner_collide() pushes an object out.
 
-    # 1 2
-    # 4 8
-    coords = enumerate((tlx + x1, tly + y1)
-                       for y1 in (0, 1) for x1 in (0, 1))
-    blks = [(i, pf.getcell(x1, min(y1, 11)) if 0 <= x1 and 0 <= y1 else 0)
-            for (i, (x1, y1)) in coords]
-    blks = sum(1 << i
-               if (16 <= t < 32 or t == MT_ELEVATOR_DOOR
-                   or (i >= 2 and with_downsolid and t == 8))
-               else 0
-               for (i, t) in blks)
-    if not blks:
-        return
+This is the slow way, used to fill four_corner_table.
 
-    if blks == 0x0F:
-        # F: all four blocks occupied; push all the way out
-        # through the closest edge
-        if dx < dy:
-            return (-16, 0) if dx < -dy else (0, 16)
-        else:
-            return (0, -16) if dx < -dy else (16, 0)
+blks -- which of the 4 cells the bounding box touches are solid
+    (1 2 / 4 8), neither 0 nor 15
+insideblk -- which cell the center is in (0 1 / 2 3)
+xside -- 0 if the box is entirely in the left column, 2 if entirely
+    in the right, or 1 if it straddles them; yside likewise for
+    the top and bottom rows
+side_closer -- rx - abs(dx) <= ry - abs(dy)
+right_of_diag -- dx > dy
+right_of_antidiag -- dx > -dy
+
+Return (xdir, ydir), each -1, 0, or 1, or None for no collision.
 
+"""
     # If the object's center isn't already embedded in a cell, and
     # its bounding box doesn't straddle a cell boundary, copy the
     # cells in the row or column where it is to the row or column
     # where it isn't.  This way, blks represents only the contour
-    # within the object's bounding box.  insideblk is as follows:
-    # 0 1
-    # 2 3
-    insideblk = (1 if dx >= 0 else 0) | (2 if dy >= 0 else 0)
+    # within the object's bounding box.
     embedded = (1 << insideblk) & blks
     if not embedded:
-        if dx <= -rx:
+        if xside == 0:
             blks = (blks & 0x05)
             blks |= (blks << 1)
-        elif dx >= rx:
+        elif xside == 2:
             blks = (blks & 0x0A)
             blks |= (blks >> 1)
-        if dy <= -ry:
+        if yside == 0:
             blks = (blks & 0x03)
             blks |= (blks << 2)
-        elif dy >= ry:
+        elif yside == 2:
             blks = (blks & 0x0C)
             blks |= (blks >> 2)
         if not blks:
-            return
+            return None
 
     # At this point we straddle a block.
 
@@ -82,7 +79,7 @@ def four_corner_collide(pf, x, y, rx, ry,
     if blks == (8 >> insideblk):
         if diag_corner_push:
             blks = 15 ^ (1 << insideblk)
-        elif rx - abs(dx) <= ry - abs(dy):
+        elif side_closer:
             # Side of block is closer.
             blks |= 1 << (insideblk ^ 1)
         else:
@@ -92,30 +89,115 @@ def four_corner_collide(pf, x, y, rx, ry,
     # Handle 1-corner and checkerboard configurations by
     # placing a block in the opposite corner.
     if blks in (1, 8, 9):
-        blks |= 4 if dx > dy else 2
+        blks |= 4 if right_of_diag else 2
     elif blks in (2, 4, 6):
         # Find opposite corner across / from top right to bottom left
-        blks |= 1 if dx > -dy else 8
-    assert blks not in (0, 1, 2, 4, 6, 8, 9, 15)
+        blks |= 1 if right_of_antidiag else 8
+    if blks in (0, 1, 2, 4, 6, 8, 9, 15):
+        # Can't be resolved.  Push nowhere, so that four_corner_collide()
+        # fails its assertion as it always has.
+        return 0, 0
 
     # remain:
     # 3, 7, B: push down
     # 5, 7, D: push right
     # A, B, E: push left
     # C, D, E: push up
-    pushx, pushy = 0, 0
-    if (blks & 0x05) == 0x05:
-        pushx = rx - dx  # Right
-    elif (blks & 0x0A) == 0x0A:
-        pushx = -rx - dx  # Left
-    if (blks & 0x03) == 0x03:
-        pushy = ry - dy  # Down
-    elif (blks & 0x0C) == 0x0C:
-        pushy = -ry - dy  # Up
+    xdir = (1 if (blks & 0x05) == 0x05
+            else -1 if (blks & 0x0A) == 0x0A
+            else 0)
+    ydir = (1 if (blks & 0x03) == 0x03
+            else -1 if (blks & 0x0C) == 0x0C
+            else 0)
+    return xdir, ydir
+
+def _make_four_corner_table():
+    """Tabulate _four_corner_push() for four_corner_collide().
+
+Index by blks, insideblk, xside, and yside.  Where the push also
+depends on the flags, the entry is a list of 16 pushes indexed by
+diag_corner_push * 8 + side_closer * 4 + right_of_diag * 2
++ right_of_antidiag.
+
+"""
+    table = []
+    for blks in range(16):
+        for insideblk in range(4):
+            for xside in range(3):
+                for yside in range(3):
+                    if blks in (0, 15):
+                        table.append(None)
+                        continue
+                    pushes = [_four_corner_push(
+                        blks, insideblk, xside, yside, flags & 8,
+                        flags & 4, flags & 2, flags & 1
+                    ) for flags in range(16)]
+                    table.append(pushes[0] if pushes.count(pushes[0]) == 16
+                                 else pushes)
+    return table
+
+four_corner_table = _make_four_corner_table()
+
+def four_corner_collide(pf, x, y, rx, ry,
+                        with_downsolid=True, diag_corner_push=False):
+    metrics.enabled and metrics.add('four_corner_collide')
+    tlx = (x - 8 * PX) // TILE
+    tly = (y - 8 * PX) // TILE
+    dx = x - (tlx + 1) * TILE
+    dy = y - (tly + 1) * TILE
+    if dy >= 0:  # already below centerline
+        with_downsolid = False
+
+    # 1 2
+    # 4 8
+    # Take bits tlx and tlx + 1 of the top and bottom rows' masks
+    rows = pf.flagrows
+    blks = 0
+    for (shift, y1) in ((0, tly), (2, tly + 1)):
+        if y1 < 0:
+            continue
+        y1 = min(y1, 11)
+        row = rows[MTF_BLOCK][y1] | rows[MTF_ELEVATOR_DOOR][y1]
+        if shift and with_downsolid:
+            row |= rows[MTF_LADDER][y1]
+        if tlx >= 0:
+            row = ((row << 32) | row) >> (tlx % 32)
+        else:
+            row = row << 1 if tlx == -1 else 0  # columns left of 0 are empty
+        blks |= (row & 0x03) << shift
+    if not blks:
+        return
+
+    if blks == 0x0F:
+        # F: all four blocks occupied; push all the way out
+        # through the closest edge
+        if dx < dy:
+            return (-TILE, 0) if dx < -dy else (0, TILE)
+        else:
+            return (0, -TILE) if dx < -dy else (TILE, 0)
+
+    # The rest depends only on which cells are solid, which cell the
+    # center is in, which cells the bounding box reaches, and
+    # sometimes which side of a few lines the center is on
+    push = four_corner_table[
+        ((blks << 2) | (1 if dx >= 0 else 0) | (2 if dy >= 0 else 0)) * 9
+        + (0 if dx <= -rx else 6 if dx >= rx else 3)
+        + (0 if dy <= -ry else 2 if dy >= ry else 1)
+    ]
+    if push.__class__ is list:
+        push = push[(8 if diag_corner_push else 0)
+                    | (4 if rx - abs(dx) <= ry - abs(dy) else 0)
+                    | (2 if dx > dy else 0) | (1 if dx > -dy else 0)]
+    if not push:
+        return
+    xdir, ydir = push
+    pushx = rx - dx if xdir > 0 else -rx - dx if xdir < 0 else 0
+    pushy = ry - dy if ydir > 0 else -ry - dy if ydir < 0 else 0
     assert pushx or pushy
     return pushx, pushy
 
 def raycast(x1, y1, x2, y2):
+    metrics.enabled and metrics.add('raycast')
     if x1 > x2:
         x1, y1, x2, y2 = x2, y2, x1, y1
     slope = (y2 - y1) / (x2 - x1)
@@ -145,42 +227,62 @@ def raycast(x1, y1, x2, y2):
         xt += 1
 
 class Critter(object):
+    # Subclasses without __slots__ also get a __dict__ for the rest
+    __slots__ = ('game', 'view', 'pos', 'facing_left', 'yvel',
+                 'walking_frame', 'mercy_time')
     hitbox_height = 8
 
     def __init__(self, game, view, x, y, facing_left=False):
         self.game = game
         self.view = view
-        self.pos = [x * 16, y * 16 + 15]
+        self.pos = [x * TILE, y * TILE + 15 * PX]
         self.facing_left = facing_left
         self.yvel = 0
         self.walking_frame = 0
         self.mercy_time = 0
 
     def getblkat(self, x, y):
-        x = int(x // 16) % 16
-        y = int(y // 16)
+        x = x // TILE % 16
+        y = y // TILE
         if y < 0:
             y += 12
         elif y >= 12:
             y -= 12
         return self.game.pf.getcell(x, y)
 
+    def blkflagat(self, flag, x, y):
+        """Return 1 if the cell that getblkat(x, y) reads has flag, else 0."""
+        x = x // TILE % 16
+        y = y // TILE
+        if y < 0:
+            y += 12
+        elif y >= 12:
+            y -= 12
+        return (self.game.pf.flagrows[flag][y] >> x) & 1
+
     def stun_test(self):
-        for b in self.game.player_projectiles:
+        x, y = self.pos
+        w, h = (4 + self.hitbox_width) * PX, (4 + self.hitbox_height) * PX
+        pairs = 0
+        for b in self.game.player_projectile_grid.query(x - w, y - 8 * PX - h,
+                                                        x + w, y - 8 * PX + h):
             if not b or not b.pos:
                 continue
-            dx = b.pos[0] - self.pos[0]
-            dy = b.pos[1] - self.pos[1] + 8
-            if (abs(dx) < 4 + self.hitbox_width
-                and abs(dy) < 4 + self.hitbox_height):
+            pairs += 1
+            dx = b.pos[0] - x
+            dy = b.pos[1] - y + 8 * PX
+            if abs(dx) < w and abs(dy) < h:
+                metrics.enabled and metrics.add('stun_test.pairs', pairs)
                 return True
+        metrics.enabled and metrics.add('stun_test.pairs', pairs)
         return False
 
     def draw16(self, screen, srcx, srcy, flip=0, dip=0):
         srcarea = (112 - srcx if flip & 1 else srcx,
                    112 - srcy if flip & 2 else srcy,
                    16, 16)
-        dstpos = (int(self.pos[0]) - 8, int(self.pos[1]) + dip - 16)
+        dstpos = (to_pixels(self.pos[0]) - 8, to_pixels(self.pos[1]) + dip - 16)
+        metrics.enabled and metrics.add('blit.draw16')
         return screen.blit(self.view.spritegfx[flip], dstpos, srcarea)
 
 class BaseWalkingCritter(Critter):
@@ -204,14 +306,14 @@ class BaseWalkingCritter(Critter):
         if not self.pos:
             return
         if vkeys & VK_RIGHT:
-            self.pos[0] += self.x_spd
+            self.pos[0] += self.x_spd * PX
             if self.state == self.ST_WALKING:
                 self.walking_frame += 32
             if self.facing_left and self.state == self.ST_HANGING:
                 self.state = self.ST_JUMPING
             self.facing_left = False
         elif vkeys & VK_LEFT:
-            self.pos[0] -= self.x_spd
+            self.pos[0] -= self.x_spd * PX
             if self.state == self.ST_WALKING:
                 self.walking_frame += 32
             if not self.facing_left and self.state == self.ST_HANGING:
@@ -221,27 +323,27 @@ class BaseWalkingCritter(Critter):
             self.walking_frame = 128
 
         if self.state == self.ST_ON_LADDER:
-            self.yvel = (-self.x_spd / 2
+            self.yvel = (-self.x_spd * PX // 2
                          if vkeys & VK_UP
-                         else self.x_spd / 2
+                         else self.x_spd * PX // 2
                          if vkeys & VK_DOWN
                          else 0)
-            if (self.getblkat(self.pos[0], self.pos[1] - 8) != 8
-                and self.getblkat(self.pos[0], self.pos[1] + 1) != 8):
+            if not (self.blkflagat(MTF_LADDER, self.pos[0], self.pos[1] - 8 * PX)
+                    or self.blkflagat(MTF_LADDER, self.pos[0], self.pos[1] + PX)):
                 self.state = self.ST_WALKING
         else:
-            self.yvel = min(4, self.yvel + 0.125)
+            self.yvel = min(4 * PX, self.yvel + PX // 8)
             if (new_vkeys & (VK_UP | VK_DOWN)) and not self.carrying_block:
-                laddercheckoffset = 1 if new_vkeys & VK_DOWN else -1
-                laddercheckblk = self.getblkat(self.pos[0], self.pos[1] + laddercheckoffset)
-                if laddercheckblk == 8:
+                laddercheckoffset = PX if new_vkeys & VK_DOWN else -PX
+                if self.blkflagat(MTF_LADDER, self.pos[0],
+                                  self.pos[1] + laddercheckoffset):
                     self.state = self.ST_ON_LADDER
         self.pos[1] = self.yvel + self.pos[1]
 
         # Treat ladders below player as solid if not already on a ladder
         ladders_below_are_solid = self.state not in (self.ST_ON_LADDER, self.ST_JUMPING)
-        pushed = four_corner_collide(self.game.pf, self.pos[0], self.pos[1] - 8,
-                                     self.hitbox_width, 8,
+        pushed = four_corner_collide(self.game.pf, self.pos[0], self.pos[1] - 8 * PX,
+                                     self.hitbox_width * PX, 8 * PX,
                                      ladders_below_are_solid,
                                      self.state == self.ST_ON_LADDER)
         on_floor = False
@@ -252,7 +354,7 @@ class BaseWalkingCritter(Critter):
                 self.pos[1] += pushed[1]
             if pushed[1] < 0:
                 if self.yvel >= 0:
-                    if self.yvel >= 0.25:
+                    if self.yvel >= PX // 4:
                         self.onland()
                     self.yvel = min(0, self.yvel)
                     on_floor = True
@@ -262,18 +364,18 @@ class BaseWalkingCritter(Critter):
         if on_floor:
             can_jump = True
             if (self.state in (self.ST_JUMPING, self.ST_HANGING)
-                or (self.state == self.ST_ON_LADDER and self.yvel > 0.25)):
+                or (self.state == self.ST_ON_LADDER and self.yvel > PX // 4)):
                 self.state = self.ST_WALKING
                 self.walking_frame = 128
         elif (self.can_hang and self.yvel > 0 and not (vkeys & VK_DOWN)
               and not self.carrying_block):
-            ledgetestx = self.pos[0] + (-5 if self.facing_left else 5)
-            ledgesolidlo = 16 <= self.getblkat(ledgetestx, self.pos[1] - 14) < 32
-            ledgesolidhi = 16 <= self.getblkat(ledgetestx, self.pos[1] - 18) < 32
+            ledgetestx = self.pos[0] + (-5 * PX if self.facing_left else 5 * PX)
+            ledgesolidlo = self.blkflagat(MTF_BLOCK, ledgetestx, self.pos[1] - 14 * PX)
+            ledgesolidhi = self.blkflagat(MTF_BLOCK, ledgetestx, self.pos[1] - 18 * PX)
             if ledgesolidlo and not ledgesolidhi:
                 self.state = self.ST_HANGING
                 self.yvel = 0
-                self.pos[1] = (self.pos[1] + 8) // 16 * 16
+                self.pos[1] = (self.pos[1] + 8 * PX) // TILE * TILE
                 can_jump = True
         elif self.state == self.ST_ON_LADDER:
             can_jump = True
@@ -283,9 +385,9 @@ class BaseWalkingCritter(Critter):
                          if self.state != self.ST_ON_LADDER
                          else VK_A)
             if new_vkeys & jump_mask:
-                self.yvel = (-self.hang_jump_power
+                self.yvel = (-self.hang_jump_power * PX
                              if self.state == self.ST_HANGING
-                             else -self.jump_power)
+                             else -self.jump_power * PX)
                 self.state = self.ST_JUMPING
                 if self.yvel < 0:
                     fxq('jump')
@@ -307,7 +409,7 @@ class BaseEnemyWalkingCritter(BaseWalkingCritter):
 
         # Move enemy toward the hole in the ceiling
         ceilcells = self.game.pf.getrow(0, 16, 0)
-        openceilcells = [16 * i + 8 for i, c in enumerate(ceilcells) if c < 16]
+        openceilcells = [i * TILE + 8 * PX for i, c in enumerate(ceilcells) if c < 16]
         if openceilcells:
             x = max(min(self.pos[0], openceilcells[-1]), openceilcells[0])
             self.pos = [x, 0]
@@ -341,7 +443,7 @@ class BaseEnemyWalkingCritter(BaseWalkingCritter):
                 self.facing_left = False
             elif pushed[0] < 0:
                 self.facing_left = True
-        if self.pos[1] >= 192 or self.pos[0] < 8 or self.pos[0] > 248:
+        if self.pos[1] >= 192 * PX or self.pos[0] < 8 * PX or self.pos[0] > 248 * PX:
             self.state = self.ST_REPOSITION
         if self.mercy_time > 0:
             self.mercy_time -= 1
@@ -398,38 +500,37 @@ class ToasterCritter(BaseEnemyWalkingCritter):
         on_floor = pushed and pushed[1] < 0
         if self.toast_time >= 180 and on_floor and self.stun_time <= 0:
             self.toast_time = -60
-            bullet = Toast(self.game, self.view, self.pos[0], self.pos[1] - 8)
+            bullet = Toast.acquire(self.game, self.view, self.pos[0], self.pos[1] - 8 * PX)
             self.game.enemy_projectiles.append(bullet)
             self.onland()  # turn randomly when firing
 
             # Turn randomly after firing
-            from random import randint
-            self.facing_left = bool(randint(0, 1))
+            self.facing_left = bool(self.game.rng.randint(0, 1))
             self.onland()  # Turn vaguely toward player
 
     def onland(self):
         """Turn the enemy if far from the player or if landing next to a cliff.
 
 """
-        if self.pos[0] < 48:
+        if self.pos[0] < 48 * PX:
             self.facing_left = False
             return
-        if self.pos[0] >= 208:
+        if self.pos[0] >= 208 * PX:
             self.facing_left = True
             return
         playerdist = self.game.player.pos[0] - self.pos[0]
-        if playerdist > 96:
+        if playerdist > 96 * PX:
             self.facing_left = False
             return
-        elif playerdist < -96:
+        elif playerdist < -96 * PX:
             self.facing_left = True
             return
         
-        gc = self.game.pf.getcell
-        xd = int(self.pos[0] // 16) + (-1 if self.facing_left else 1)
-        yd = int((self.pos[1] + 8) // 16)
-        c = gc(xd, yd) if 0 <= xd < 16 and 0 <= yd < 12 else 0
-        if c < 16 and c != 8:
+        xd = self.pos[0] // TILE + (-1 if self.facing_left else 1)
+        yd = (self.pos[1] + 8 * PX) // TILE
+        floor = (self.game.pf.getflag(MTF_FLOOR, xd, yd)
+                 if 0 <= xd < 16 and 0 <= yd < 12 else 0)
+        if not floor:
             print("not driving off cliff at %d,%d" % (xd, yd))
             self.facing_left = not self.facing_left
 
@@ -448,7 +549,7 @@ class ToasterCritter(BaseEnemyWalkingCritter):
         else:
             dip = max(0, -55 - self.toast_time)
         srcarea = (120 - srcx if xflip & 1 else srcx, srcy, 8, 8)
-        dstpos = (int(self.pos[0]) - 8, int(self.pos[1]) + dip - 16)
+        dstpos = (to_pixels(self.pos[0]) - 8, to_pixels(self.pos[1]) + dip - 16)
         rects.append(screen.blit(self.view.spritegfx[0], dstpos, srcarea))
         return rects
 
@@ -460,32 +561,33 @@ class SneakerCritter(BaseEnemyWalkingCritter):
     def __init__(self, *a, **k):
         BaseEnemyWalkingCritter.__init__(self, *a, **k)
         self.damaged = 0  # counts up to 16 after damaged; invulnerable 1-15
-        self.crouchtestx = self.pos[0] // 16
+        self.crouchtestx = self.pos[0] // TILE
         self.crouch_time = 0
 
     def block_is_threat(self, blk):
         if not blk.pos:
             return False
         dy = blk.pos[1] - self.pos[1]
-        if dy > 32:  # below self
+        if dy > 32 * PX:  # below self
             return False
         dx = blk.pos[0] - self.pos[0]
         if self.facing_left:
             dx = -dx
-        if dx < -12:  # can't see behind self
+        if dx < -12 * PX:  # can't see behind self
             return False
         blk_left = blk.xvel < 0
         facing_diff = not blk_left if self.facing_left else blk_left
         return facing_diff
 
     def block_in_the_way(self, other_pos):
-        gc = self.game.pf.getcell
+        blocks = self.game.pf.flagrows[MTF_BLOCK]
         x1, y1 = self.pos
         x2, y2 = other_pos
 
         p_x, p_y = self.game.player.pos
-        traced = raycast(x1 / 16, (y1 - 8) / 16, x2 / 16, (y2 - 8) / 16)
-        return any(16 <= gc(x, y) < 32 for (x, y) in traced)
+        traced = raycast(x1 / TILE, (y1 - 8 * PX) / TILE,
+                         x2 / TILE, (y2 - 8 * PX) / TILE)
+        return any((blocks[y] >> (x % 32)) & 1 for (x, y) in traced)
         
     def player_is_threat(self, p):
         """Determine whether another critter is a "threat" to this critter.
@@ -529,15 +631,19 @@ TO DO: Another with blocks preventing eye contact is not a threat.
                 return True
         else:
             # If not crouched, stand until leaving this column.
-            xt = self.pos[0] // 16
+            xt = self.pos[0] // TILE
             if xt == self.crouchtestx:
                 return False
             else:
                 self.crouchtestx = xt
 
         # If threatened by a block or player, crouch.
-        if (any(self.block_is_threat(blk)
-                for blk in self.game.player_projectiles)
+        x, y = self.pos
+        left, right = ((-256 * PX, x + 12 * PX) if self.facing_left
+                       else (x - 12 * PX, 512 * PX))
+        nearby = self.game.player_projectile_grid.query(left, -256 * PX,
+                                                        right, y + 32 * PX)
+        if (any(self.block_is_threat(blk) for blk in nearby)
             or self.player_is_threat(self.game.player)):
             self.crouch_time = 30
             return True
@@ -566,7 +672,7 @@ TO DO: Another with blocks preventing eye contact is not a threat.
             srcy = 64
             srcarea = (112 - srcx if xflip & 1 else srcx, srcy,
                        16, 8)
-            dstpos = (int(self.pos[0]) - 8, int(self.pos[1]) - 8)
+            dstpos = (to_pixels(self.pos[0]) - 8, to_pixels(self.pos[1]) - 8)
             return [screen.blit(self.view.spritegfx[xflip], dstpos, srcarea)]
             
         if self.walking_frame >= 256:
@@ -589,13 +695,12 @@ class BaseFlyingCritter(Critter):
         self.reposition(facing_left)
 
     def reposition(self, facing_left=None):
-        from random import randint
         if facing_left is None:
             facing_left = not self.facing_left
         self.facing_left = facing_left
 
-        y = 5 * randint(0, 31) + 18
-        self.pos = [252 if facing_left else 4, y]
+        y = 5 * self.game.rng.randint(0, 31) + 18
+        self.pos = [(252 if facing_left else 4) * PX, y * PX]
         self.stun_time = 15  # allow player to get out of way
 
     def move(self):
@@ -604,12 +709,12 @@ class BaseFlyingCritter(Critter):
         if self.stun_time > 0:
             self.stun_time -= 1
         elif self.facing_left:
-            self.pos[0] -= self.x_spd
+            self.pos[0] -= self.x_spd * PX
             if self.pos[0] < 0:
                 self.reposition()
         else:
-            self.pos[0] += self.x_spd
-            if self.pos[0] >= 256:
+            self.pos[0] += self.x_spd * PX
+            if self.pos[0] >= 256 * PX:
                 self.reposition()
         if self.mercy_time > 0:
             self.mercy_time -= 1
@@ -643,6 +748,29 @@ class BurgerCritter(BaseFlyingCritter):
         xflip = 1 if self.facing_left else 0
         return [self.draw16(screen, 0, 80, xflip)]
 
+class EnemySequence(object):
+    """Iterate over a level's enemy names, looping if looped.
+
+Unlike itertools.cycle(), its position is an attribute, so it can
+be saved in a snapshot.
+
+"""
+    def __init__(self, enemies, looped):
+        self.enemies = list(enemies)
+        self.looped = looped
+        self.next_index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.next_index >= len(self.enemies):
+            if not (self.looped and self.enemies):
+                raise StopIteration
+            self.next_index = 0
+        self.next_index += 1
+        return self.enemies[self.next_index - 1]
+
 class EnemyFactory(object):
     enemymap = {
         'plodder': PloddingCritter,
@@ -654,12 +782,11 @@ class EnemyFactory(object):
     }
 
     def __init__(self, leveldata, game, view):
-        from itertools import cycle
         (levelname, mapid, limit, enemies, looped) = leveldata[:5]
         self.game = game
         self.view = view
         self.limit = limit
-        self.iterenemies = cycle(enemies) if looped else iter(enemies)
+        self.iterenemies = EnemySequence(enemies, looped)
         self.timer = 0
         self.facing_left = False
 
@@ -668,14 +795,14 @@ class EnemyFactory(object):
 
     def __next__(self):
         # remove dead enemies in list
-        pfen = [e for e in self.game.enemies if e and e.pos]
-        self.game.enemies[:] = pfen
+        compact(self.game.enemies)
+        num_enemies = len(self.game.enemies)
 
         if self.game.spawn_time > 0:
             self.game.spawn_time -= 1
-        if self.limit == 0 and len(pfen) == 0:
+        if self.limit == 0 and num_enemies == 0:
             raise StopIteration
-        if self.game.spawn_time > 0 or len(pfen) >= self.limit:
+        if self.game.spawn_time > 0 or num_enemies >= self.limit:
             return None
         self.game.spawn_time = 30
         try:
@@ -689,20 +816,23 @@ class EnemyFactory(object):
             self.facing_left = not self.facing_left
             return new_enemy
 
-class Toast(Critter):
+class Toast(Pooled, Critter):
+    __slots__ = ('stun_time',)
+    free_list = []
     hitbox_width = 3
     hitbox_height = 4
 
-    def __init__(self, game, view, x, y):
-        Critter.__init__(self, game, view, 0, 0)
-        self.stun_time = 0
+    def reset(self, game, view, x, y):
+        self.game, self.view = game, view
         self.pos = [x, y]
-        self.yvel = -3
+        self.facing_left = False
+        self.yvel = -3 * PX
+        self.walking_frame = self.mercy_time = self.stun_time = 0
 
     def move(self):
         self.pos[1] += self.yvel
-        self.yvel += .125
-        if self.pos[1] >= 184:
+        self.yvel += PX // 8
+        if self.pos[1] >= 184 * PX:
             self.pos = None
             return
 
@@ -710,18 +840,21 @@ class Toast(Critter):
         if not self.pos:
             return []
         srcarea = (32, 88, 8, 8)
-        dstpos = (int(self.pos[0]) - 4, int(self.pos[1]) - 8)
+        dstpos = (to_pixels(self.pos[0]) - 4, to_pixels(self.pos[1]) - 8)
         return [screen.blit(self.view.spritegfx[0], dstpos, srcarea)]
 
-class Poof(Critter):
+class Poof(Pooled, Critter):
+    __slots__ = ('stun_time',)
+    free_list = []
     hitbox_width = 0
     hitbox_height = 0
 
-    def __init__(self, game, view, x, y):
-        Critter.__init__(self, game, view, 0, 0)
-        self.stun_time = 0
+    def reset(self, game, view, x, y):
+        self.game, self.view = game, view
         self.pos = [x, y]
-        self.yvel = -3
+        self.facing_left = False
+        self.yvel = -3 * PX
+        self.walking_frame = self.mercy_time = self.stun_time = 0
 
     def move(self):
         self.walking_frame += 1
@@ -734,7 +867,7 @@ class Poof(Critter):
         if not self.pos:
             return []
         sep = max(0, progress - 8) // 4 + 4
-        xbase, ybase = int(self.pos[0]) - 4, int(self.pos[1]) - 12
+        xbase, ybase = to_pixels(self.pos[0]) - 4, to_pixels(self.pos[1]) - 12
         srcx = 40 + 8 * f
         cmds = [(0, (xbase - sep, ybase - sep), (srcx, 80, 8, 8)),
                 (3, (xbase + sep, ybase - sep), (120 - srcx, 120 - 88, 8, 8)),
@@ -757,13 +890,13 @@ class ChipCritter(BaseFlyingCritter):
     def reposition(self, ignored1=None):
         row, self.facing_left = self.factory.get_next_row()
         y = 16 * row + 12
-        self.pos = [252 if self.facing_left else 4, y]
+        self.pos = [(252 if self.facing_left else 4) * PX, y * PX]
 
     def draw(self, screen):
         if not self.pos:
             return []
         srcarea = (24, 24, 8, 8)
-        dstpos = (int(self.pos[0]) - 4, int(self.pos[1]) - 8)
+        dstpos = (to_pixels(self.pos[0]) - 4, to_pixels(self.pos[1]) - 8)
         return [screen.blit(self.view.spritegfx[0], dstpos, srcarea)]
 
 class ChipFactory(object):
@@ -781,16 +914,15 @@ class ChipFactory(object):
         self.chips = []
 
     def get_next_row(self):
-        from random import randint
-
-        pull_idx = randint(0, 1) if len(self.y_lru) >= 4 else 0        
+        randint = self.game.rng.randint
+        pull_idx = randint(0, 1) if len(self.y_lru) >= 4 else 0
         pulled = self.y_lru.pop(pull_idx)
         self.y_lru.append(pulled)
         self.facing_left = not self.facing_left
         return pulled, self.facing_left
 
     def collect(self, pos):
-        row = int(pos[1] // 16)
+        row = pos[1] // TILE
         try:
             self.y_lru.remove(row)
         except IndexError:
@@ -799,7 +931,7 @@ class ChipFactory(object):
             fxq('getchip')
             num = 9 - len(self.y_lru)
             if 1 <= num <= 8:
-                dig = FloatingDigit(self.game, self.view, pos[0], pos[1], num)
+                dig = FloatingDigit.acquire(self.game, self.view, pos[0], pos[1], num)
                 self.game.enemy_projectiles.append(dig)
 
     def move(self):
@@ -807,18 +939,17 @@ class ChipFactory(object):
         px, py = self.game.player.pos
         for e in self.chips:
             e.move()
-            dy = e.pos[1] + 4 - py
+            dy = e.pos[1] + 4 * PX - py
             dx = e.pos[0] - px
-            if abs(dx) < 8 and abs(dy) < 12:
+            if abs(dx) < 8 * PX and abs(dy) < 12 * PX:
                 self.collect(e.pos)
                 e.pos = None
         
-        pfen = [e for e in self.chips if e and e.pos]
-        self.chips[:] = pfen
+        compact(self.chips)
 
         if len(self.y_lru) == 0:
             return True
-        if len(pfen) < min(2, len(self.y_lru)):
+        if len(self.chips) < min(2, len(self.y_lru)):
             self.chips.append(ChipCritter(self.game, self.view, self))
 
     def draw(self, screen):
@@ -828,14 +959,17 @@ class ChipFactory(object):
                 rects.extend(e.draw(screen))
         return rects
 
-class FloatingDigit(Critter):
+class FloatingDigit(Pooled, Critter):
+    __slots__ = ('num',)
+    free_list = []
     hitbox_width = 0
     hitbox_height = 0
 
-    def __init__(self, game, view, x, y, num):
-        Critter.__init__(self, game, view, 0, 0)
-        self.walking_frame = 0
+    def reset(self, game, view, x, y, num):
+        self.game, self.view = game, view
         self.pos = [x, y]
+        self.facing_left = False
+        self.yvel = self.walking_frame = self.mercy_time = 0
         self.num = num
 
     def move(self):
@@ -846,8 +980,8 @@ class FloatingDigit(Critter):
             self.pos = None
         if not self.pos:
             return []
-        dstpos = (int(self.pos[0]) - 4,
-                  int(self.pos[1]) - 8 - (self.walking_frame // 4))
+        dstpos = (to_pixels(self.pos[0]) - 4,
+                  to_pixels(self.pos[1]) - 8 - (self.walking_frame // 4))
         srcarea = (8 * (self.num - 1), 32, 8, 8)
         return [screen.blit(self.view.spritegfx[0], dstpos, srcarea)]
 
@@ -1,5 +1,110 @@
 #!/usr/bin/env python3
 import pygame as G
+import sys, threading
+from collections import deque
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def surface_colors(surfaces, extra_colors=()):
+    """List the opaque colors used in surfaces, plus extra_colors.
+
+The result can be passed to Enlarger.set_capture_palette().
+
+"""
+    colors = set(tuple(c[:3]) for c in extra_colors)
+    for surface in surfaces:
+        data = G.image.tostring(surface, 'RGBA')
+        colors.update(tuple(bytearray(data[i:i + 3]))
+                      for i in range(0, len(data), 4) if data[i + 3])
+    return sorted(colors)
+
+class VideoTee(object):
+    """Write captured frames to a file on a background thread.
+
+The game loop hands each frame to put() and goes on while a writer
+thread copies frames from a bounded queue to outfp, so a slow
+encoder at the other end of a pipe doesn't stall the 60 Hz loop
+until the queue fills.  What happens then depends on drop: if
+False, put() waits for room; if True, the frame is dropped.
+
+frames_queued, frames_written, and frames_dropped count frames.
+If a write fails, the exception is kept in error, no more frames are
+written, and close() raises it.
+
+A frame may be a bytearray from get_buffer().  Once it has been
+written or dropped, it goes back to be reused by a later
+get_buffer(), so capture doesn't allocate a new frame every time.
+
+"""
+    def __init__(self, outfp, max_frames=30, drop=False):
+        self.outfp = outfp
+        self.drop = drop
+        self.frames_queued = self.frames_written = self.frames_dropped = 0
+        self.error = None
+        self.free_buffers = deque()
+        self.queue = queue.Queue(max_frames)
+        self.thread = threading.Thread(target=self.run, name="VideoTee")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get_buffer(self, size):
+        """Return a bytearray of size bytes to fill and put()."""
+        try:
+            buf = self.free_buffers.pop()
+        except IndexError:
+            return bytearray(size)
+        return buf if len(buf) == size else bytearray(size)
+
+    def recycle(self, frame):
+        if isinstance(frame, bytearray):
+            self.free_buffers.append(frame)
+
+    def put(self, frame):
+        """Queue a frame to be written.  Return False if it was dropped."""
+        if self.error is not None:
+            self.frames_dropped += 1
+            self.recycle(frame)
+            return False
+        if self.drop:
+            try:
+                self.queue.put_nowait(frame)
+            except queue.Full:
+                self.frames_dropped += 1
+                self.recycle(frame)
+                return False
+        else:
+            self.queue.put(frame)
+        self.frames_queued += 1
+        return True
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is None:
+                try:
+                    self.outfp.write(frame)
+                except Exception as e:
+                    self.error = e
+                else:
+                    self.frames_written += 1
+            self.recycle(frame)
+
+    def close(self):
+        """Wait for queued frames to be written.  Does not close outfp."""
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
 
 class Enlarger(object):
     def __init__(self, dst, src_wh, flip_after=False):
@@ -14,30 +119,314 @@ flip_after -- if True, flip() chains to pygame.display.flip()
         self.dst = dst
         self.src = G.Surface(src_wh, 0, dst) if src_wh else None
         self.flip_after = flip_after
-        self.videotee_fp = None
+        self.videotee_fp = self.videotee = None
         self.videotee_skip = 1
         self.videotee_left = 0
         self.num_frames = 0
         self.pixel_format = 'RGB'
+        self.pal8_inline_palette = False
+        self.pal8_fixed_palette = False
+        self.capture_delta = None
+        self.set_capture_palette(())
+
+    def set_videotee(self, outfp, divisor=1, max_frames=30, drop=False):
+        """Capture every divisor-th frame to outfp, or stop if outfp is None.
 
-    def set_videotee(self, outfp, divisor=1):
+Frames are written by a VideoTee; see it for max_frames and drop.
+
+"""
+        self.close_videotee()
         self.videotee_fp = outfp
         self.videotee_skip = divisor
+        if outfp:
+            self.videotee = VideoTee(outfp, max_frames, drop)
+
+    def set_capture_delta(self, enabled=True):
+        """Capture only the areas passed to flip() since the last capture.
+
+Frames are in deltavid.py format, whose decoder expands them back
+to raw video.  Call after setting pixel_format.
+
+"""
+        self.capture_delta = None
+        if enabled:
+            from deltavid import DeltaEncoder
+            w, h = self.get_surface().get_size()
+            self.capture_delta = DeltaEncoder(w, h, self.capture_pix_fmt())
+
+    def close_videotee(self):
+        """Finish writing captured frames and stop capturing.
+
+Return the VideoTee, whose counters are then final, or None.
+
+"""
+        videotee = self.videotee
+        self.videotee_fp = self.videotee = None
+        if videotee:
+            videotee.close()
+        return videotee
 
     def get_surface(self):
         return self.src or self.dst
 
-    def flip(self):
+    # FFmpeg -pix_fmt for each pixel_format that pygame.image.tostring()
+    # can produce
+    tostring_pix_fmts = {'RGB': 'rgb24', 'RGBX': 'rgb0', 'RGBA': 'rgba',
+                         'ARGB': 'argb', 'BGRA': 'bgra'}
+
+    def set_capture_palette(self, colors):
+        """Set the colors for pixel_format 'P'.
+
+colors -- a list of (r, g, b), such as from surface_colors()
+
+In pixel_format 'P', each captured frame is one byte per pixel,
+the index of that pixel's color in capture_palette.  A color not
+in the palette is added if there is room for it, or else mapped to
+the closest color in the palette.  If pal8_fixed_palette is True,
+there is no more room once the first frame has been captured, for
+formats such as APNG that store one palette for the whole video.
+
+"""
+        surface = self.get_surface()
+        self.capture_rgbmask = sum(surface.get_masks()[:3])
+        self.capture_shift = min(surface.get_shifts()[:3])
+        self.capture_lut = None
+        self.capture_palette = []
+        self.capture_palette_limit = 256
+        self.capture_table = {}
+        for c in colors[:256]:
+            self.capture_table[surface.map_rgb(c) & self.capture_rgbmask] = len(self.capture_palette)
+            self.capture_palette.append(tuple(c[:3]))
+
+    def update_capture_table(self):
+        """Copy capture_table to the arrays that capture_pal8() uses.
+
+capture_lut maps each color, shifted down to bit 0, to its index.
+capture_keys holds the shifted color of each index, so that
+capture_pal8() can tell which pixels capture_lut doesn't know.
+capture_pal8() calls this on its first frame after
+set_capture_palette(), so other pixel formats never allocate them.
+
+"""
+        if np is None:
+            return
+        shift = self.capture_shift
+        if self.capture_lut is None:
+            # 16 MiB for 24-bit color, allocated only for pal8 capture
+            self.capture_lut = np.zeros((self.capture_rgbmask >> shift) + 1,
+                                        dtype=np.uint8)
+        self.capture_keys = np.zeros(256, dtype=np.uint32)
+        self.capture_keys[:] = len(self.capture_lut)
+        for pixel, index in self.capture_table.items():
+            self.capture_lut[pixel >> shift] = index
+            if pixel == self.capture_palette_pixel(index):
+                self.capture_keys[index] = pixel >> shift
+
+    def capture_palette_pixel(self, index):
+        c = self.capture_palette[index]
+        return self.get_surface().map_rgb(c) & self.capture_rgbmask
+
+    def capture_index(self, pixel):
+        """Find the palette index of a pixel value not in capture_table."""
+        r, g, b = self.get_surface().unmap_rgb(pixel)[:3]
+        if len(self.capture_palette) < self.capture_palette_limit:
+            index = len(self.capture_palette)
+            self.capture_palette.append((r, g, b))
+        else:
+            index = min(range(len(self.capture_palette)), key=lambda i: (
+                (self.capture_palette[i][0] - r) ** 2
+                + (self.capture_palette[i][1] - g) ** 2
+                + (self.capture_palette[i][2] - b) ** 2
+            ))
+        self.capture_table[pixel] = index
+        return index
+
+    def capture_palette_bytes(self, pix_fmt='rgb24'):
+        """Return the palette as 256 rgb24 or bgra entries.
+
+rgb24 is 768 bytes, as in a palette side file.  bgra is the
+1024-byte palette that FFmpeg's rawvideo pal8 expects after each
+frame's indices.
+
+"""
+        palette = self.capture_palette + [(0, 0, 0)] * (256 - len(self.capture_palette))
+        if pix_fmt == 'bgra':
+            return bytes(bytearray(x for r, g, b in palette for x in (b, g, r, 255)))
+        return bytes(bytearray(x for c in palette for x in c))
+
+    def capture_pix_fmt(self):
+        """Return the FFmpeg pixel format name of captured frames.
+
+If pixel_format is None, frames are the surface's own pixels, such
+as bgr0 for a 32-bit surface with blue in the low byte.  Raise
+ValueError if the surface can't be captured in pixel_format, so
+call this once before capturing to fail before play starts.
+
+"""
+        if self.pixel_format == 'P':
+            surface = self.get_surface()
+            if surface.get_bytesize() != 4:
+                raise ValueError("can't capture %d-bit pixels as pal8"
+                                 % surface.get_bitsize())
+            return 'pal8'
+        if self.pixel_format is not None:
+            return self.tostring_pix_fmts[self.pixel_format]
+        surface = self.get_surface()
+        bytesize = surface.get_bytesize()
+        if bytesize not in (3, 4):
+            raise ValueError("can't capture %d-bit pixels"
+                             % surface.get_bitsize())
+        channels = ['0'] * bytesize
+        for name, shift, mask in zip('rgba', surface.get_shifts(),
+                                     surface.get_masks()):
+            if mask:
+                channels[shift // 8] = name
+        if sys.byteorder != 'little':
+            channels.reverse()
+        if bytesize == 3:
+            return ''.join(channels) + '24'
+        return ''.join(channels)
+
+    def capture_frame(self):
+        """Copy get_surface() to a frame for the video tee.
+
+If pixel_format is None, copy the surface's pixels through its
+buffer interface into a reused buffer.  If it is 'P', look up each
+pixel's palette index.  Otherwise convert the pixels to
+pixel_format with pygame.image.tostring().
+
+"""
+        surface = self.get_surface()
+        if self.pixel_format == 'P':
+            return self.capture_pal8()
+        if self.pixel_format is not None:
+            bottom_up = False
+            return G.image.tostring(surface, self.pixel_format, bottom_up)
+        w, h = surface.get_size()
+        rowlen = w * surface.get_bytesize()
+        pitch = surface.get_pitch()
+        buf = self.videotee.get_buffer(rowlen * h)
+        pixels = memoryview(surface.get_buffer())
+        try:
+            if pitch == rowlen:
+                buf[:] = pixels
+            else:
+                for y in range(h):
+                    buf[y * rowlen:(y + 1) * rowlen] = pixels[y * pitch:y * pitch + rowlen]
+        finally:
+            # The surface stays locked until its buffer is released
+            pixels.release()
+        return buf
+
+    def capture_pal8(self):
+        """Copy get_surface() to a frame of palette indices.
+
+If pal8_inline_palette is True, the palette follows the indices
+as FFmpeg's rawvideo pal8 expects.
+
+"""
+        surface = self.get_surface()
+        w, h = surface.get_size()
+        stride = surface.get_pitch() // 4
+        palsize = 1024 if self.pal8_inline_palette else 0
+        buf = self.videotee.get_buffer(w * h + palsize)
+        mask = self.capture_rgbmask
+        pixels = memoryview(surface.get_buffer())
+        try:
+            if np is not None:
+                if self.capture_lut is None:
+                    self.update_capture_table()
+                px = np.frombuffer(pixels, dtype=np.uint32)
+                px = (px.reshape(h, stride)[:, :w] & mask) >> self.capture_shift
+                i = np.take(self.capture_lut, px)
+                missing = np.take(self.capture_keys, i) != px
+                if missing.any():
+                    # Colors mapped to the closest color in a full or
+                    # fixed palette stay missing, so only rebuild for new ones
+                    added = False
+                    for pixel in np.unique(px[missing]):
+                        pixel = int(pixel) << self.capture_shift
+                        if pixel not in self.capture_table:
+                            self.capture_index(pixel)
+                            added = True
+                    if added:
+                        self.update_capture_table()
+                        i = np.take(self.capture_lut, px)
+                out = np.frombuffer(buf, dtype=np.uint8, count=w * h)
+                out[:] = i.ravel()
+                out = None
+            else:
+                px = pixels.cast('I')
+                table = self.capture_table
+                for y in range(h):
+                    row = px[y * stride:y * stride + w]
+                    buf[y * w:(y + 1) * w] = bytearray(
+                        table[p & mask] if p & mask in table
+                        else self.capture_index(p & mask)
+                        for p in row)
+                row = None
+            px = None
+        finally:
+            pixels.release()
+        if palsize:
+            buf[w * h:] = self.capture_palette_bytes('bgra')
+        if self.pal8_fixed_palette:
+            self.capture_palette_limit = len(self.capture_palette)
+        return buf
+
+    def scale_rects(self, rects):
+        """Scale parts of the surface to dst.
+
+rects -- areas of get_surface() to copy
+Return the corresponding areas of the screen, for
+pygame.display.update().
+
+"""
+        src, d = self.src, self.dst
+        bounds = self.get_surface().get_rect()
+        ox, oy = d.get_abs_offset()
+        out = []
+        for r in rects:
+            r = bounds.clip(r)
+            if not r:
+                continue
+            if src:
+                sw, sh = src.get_size()
+                dw, dh = d.get_size()
+                l, t = r.left * dw // sw, r.top * dh // sh
+                dr = G.Rect(l, t, r.right * dw // sw - l, r.bottom * dh // sh - t)
+                G.transform.scale(src.subsurface(r), dr.size, d.subsurface(dr))
+                r = dr
+            out.append(r.move(ox, oy))
+        return out
+
+    def flip(self, rects=None):
+        """Scale the surface to dst and update the screen.
+
+rects -- if not None, a list of the only areas of get_surface()
+that changed since the last flip
+
+"""
         d = self.dst
-        if self.src:
-            G.transform.scale(self.src, (d.get_width(), d.get_height()), d)
-        if self.flip_after:
-            G.display.flip()
+        if self.capture_delta and self.videotee_fp:
+            self.capture_delta.add_rects(rects)
+        if rects is not None:
+            rects = self.scale_rects(rects)
+            if self.flip_after and rects:
+                G.display.update(rects)
+        else:
+            if self.src:
+                G.transform.scale(self.src, (d.get_width(), d.get_height()), d)
+            if self.flip_after:
+                G.display.flip()
         if self.videotee_fp:
             if self.videotee_left <= 0:
                 self.videotee_left += self.videotee_skip
-                bottom_up = False
-                s = G.image.tostring(self.get_surface(), self.pixel_format, bottom_up)
-                self.videotee_fp.write(s)
+                frame = self.capture_frame()
+                if self.capture_delta:
+                    self.videotee.recycle(frame)
+                    frame = self.capture_delta.encode(frame)
+                if not self.videotee.put(frame) and self.capture_delta:
+                    self.capture_delta.dropped()
             self.videotee_left -= 1
         self.num_frames += 1
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Drop dead critters and projectiles, and reuse the short-lived ones.
+
+A critter dies by setting its pos to None.  compact() then closes
+the gaps in a list of critters in place, keeping the survivors in
+order.  Order decides which critter a projectile hits first and
+which sprite is drawn on top, so it must not change from one run of
+a recording to the next.
+
+Projectiles and effects that come and go many times a second are
+Pooled.  compact() puts each dead one back on its class's free list,
+and acquire() reuses one from there instead of making a new object.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import metrics
+
+class Pooled(object):
+    """Mixin for objects that are reused once they die.
+
+A pooled class defines reset(), taking the arguments that would be
+passed to the constructor, and its own free_list = [].  reset() must
+set every attribute, as a reused object keeps whatever its last life
+left behind.  Make objects with cls.acquire(...), not cls(...).
+
+"""
+    __slots__ = ()
+    free_list = None
+
+    def __init__(self, *args):
+        metrics.enabled and metrics.add('new.' + type(self).__name__)
+        self.reset(*args)
+
+    @classmethod
+    def acquire(cls, *args):
+        """Return a dead object from the free list reset with args,
+or a new object if the free list is empty."""
+        free_list = cls.free_list
+        if not free_list:
+            return cls(*args)
+        obj = free_list.pop()
+        metrics.enabled and metrics.add('reuse.' + cls.__name__)
+        obj.reset(*args)
+        return obj
+
+    def release(self):
+        """Put a dead object on its class's free list."""
+        self.free_list.append(self)
+
+def compact(objs):
+    """Remove objects that are None or whose pos is None from a list.
+
+Removed Pooled objects are released for reuse.  Return the number
+of objects removed.
+
+"""
+    dst = 0
+    for src, obj in enumerate(objs):
+        if obj and obj.pos:
+            if dst < src:
+                objs[dst] = obj
+            dst += 1
+        elif isinstance(obj, Pooled):
+            obj.release()
+    removed = len(objs) - dst
+    if removed:
+        del objs[dst:]
+    return removed
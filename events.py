@@ -47,5 +47,5 @@ def translate_events(addlkeys=[]):
                     event_vkeys |= vkey
                     break
         if not event_handled:
-            other_events = []
+            other_events.append(event)
     return event_vkeys, other_events
@@ -1,23 +1,29 @@
 #!/usr/bin/env python3
 from __future__ import with_statement, division, print_function, unicode_literals
 import pygame as G
-import ascii, chipsfx, joycfg, loadlevel, mtplane
+import random
+import ascii, chipsfx, joycfg, loadlevel, metrics, mtplane
 from events import VK_A, VK_B, VK_UP, VK_DOWN, VK_LEFT, VK_RIGHT
 from events import translate_events, VK_SELECT, VK_START
 from fhbgui import read_pads
+from broadphase import SpatialGrid
+from entities import compact
+from enemy import PX, TILE
 
 action_names = [
     'Up', 'Down', 'Left', 'Right',
     'Jump', 'Fire', 'Select', 'Start'
 ]
 keybindings_filename = "fhbg.kyb"
+sfxcache_filename = "fhbg.sfx"
 mixer_freq = 44100
 with_double = True
 with_fullscreen = False
 with_music = True
 
 # False (no video output), True (raw RGB24 frames to vtee.raw),
-# or 'pipe' (through vidcap_pipe_cmd)
+# 'pipe' (through vidcap_pipe_cmd), or 'apng' or 'png' (encoded
+# by pngenc.py to vtee.png or vtee00000.png, vtee00001.png, ...)
 # use -c:v png for all intraframes
 # or -c:v zmbv for intraframes and deltaframes
 # but apparently avconv version 0.8.6-4:0.8.6-0ubuntu0.12.04.1 can't
@@ -27,8 +33,50 @@ with_music = True
 # I tried Bisqwit's ZMBV encoder but it supports only BGR and Pygame
 # supports only RGB.
 with_vidcap = False
-vidcap_pipe_cmd = r"""avconv -f rawvideo -r 30 -pix_fmt rgb24 -s "256x176" -y -an -i - -c:v png fhbg.avi"""
+# 'RGB' converts each captured frame to rgb24.  None writes the
+# screen's own pixels (usually bgr0) without converting them.
+# 'P' writes pal8, one palette index per pixel, which codecs such
+# as zmbv take directly.  The palette goes to vtee.pal (256 RGB
+# triples), or after each frame through the pipe as FFmpeg expects.
+# %(pix_fmt)s in vidcap_pipe_cmd becomes the matching -pix_fmt.
+vidcap_pixel_format = 'RGB'
+# If True, capture to vtee.dlt only the areas of each frame that
+# changed; deltavid.py expands it to vtee.raw.  Not used with 'pipe'.
+vidcap_delta = False
+vidcap_pipe_cmd = r"""avconv -f rawvideo -r 30 -pix_fmt %(pix_fmt)s -s "256x176" -y -an -i - -c:v png fhbg.avi"""
 ##vidcap_pipe_cmd = r"""zmbv/zmbv_encoder -o fhbg.avi --width 256 --height 176 --bpp 24 --swapredblue --fps 30"""
+# Captured frames wait in a queue of up to vidcap_queue_frames frames
+# for a background thread to write them.  When it's full, drop new
+# frames if vidcap_drop_frames, or else wait for the encoder.
+vidcap_queue_frames = 30
+vidcap_drop_frames = False
+
+# Save each game's controller input to replay_filename, which
+# replay.py can render to video later without anyone at the keyboard
+with_replay_log = True
+replay_filename = "fhbg.rec"
+
+# In practice mode, hold Select to run time backward through the
+# last rewind_frames frames of play, kept in at most rewind_bytes
+rewind_frames = 1800
+rewind_bytes = 4 << 20
+
+# During play, F3 shows the minimum, mean, and 99th percentile time
+# in milliseconds of each phase of the last perf_window frames:
+# reading input, moving, saving or restoring rewind snapshots,
+# drawing, logging input and state checksums, starting sound
+# effects, waiting for the next frame, and scaling and flipping the
+# screen.  If perf_csv_filename is set, each frame's times are also
+# written to it, whether or not they are shown.
+perf_hud_key = G.K_F3
+perf_window = 120
+perf_csv_filename = None
+play_phases = ('input', 'move', 'rewind', 'draw', 'log',
+               'sfx', 'tick', 'flip')
+
+# If set, write metrics.py counts to this file as JSON, one line per
+# frame and a line of totals at the end of each level
+metrics_filename = None
 
 todoNotice = """
 PyFHBG 0.02
@@ -197,9 +245,12 @@ class FHBGView(object):
         self.display = Enlarger(screen, logisize if with_double else None, True)
 
         self.font = PyGtxt(G.image.load('tilesets/ascii.png'), 8, 8)
-        sfx = chipsfx.make_sound_effects(sfxdata)
-        self.sfx = dict((name, G.mixer.Sound(samples))
-                        for (name, samples) in sfx.items())
+        if G.mixer.get_init():
+            sfx = chipsfx.make_sound_effects(sfxdata, sfxcache_filename)
+            self.sfx = dict((name, G.mixer.Sound(samples))
+                            for (name, samples) in sfx.items())
+        else:
+            self.sfx = None  # replaying offline; effects are only logged
 
         self.bggfx = G.image.load('tilesets/bggfx1.png').convert_alpha()
         spritegfx = G.image.load('tilesets/spritegfx.png')
@@ -213,19 +264,82 @@ class FHBGView(object):
                           G.transform.flip(spritegfx, True, True)]
         self.ffpipe = self.video_outfp = None
         if with_vidcap:
-            if with_vidcap == 'pipe':
+            self.display.pixel_format = vidcap_pixel_format
+            pix_fmt = self.display.capture_pix_fmt()
+            if vidcap_pixel_format == 'P':
+                from enlarger import surface_colors
+                self.display.set_capture_palette(surface_colors(
+                    [self.bggfx, spritegfx, self.font.img],
+                    [(0, 0, 0), (102, 102, 102)]
+                ))
+                self.display.pal8_inline_palette = with_vidcap != True
+                # An APNG has one PLTE, taken from its first frame
+                self.display.pal8_fixed_palette = with_vidcap == 'apng'
+            if with_vidcap in ('apng', 'png'):
+                from pngenc import PNGWriter
+                w, h = self.display.get_surface().get_size()
+                self.video_outfp = PNGWriter(
+                    'vtee.png' if with_vidcap == 'apng' else 'vtee%05d.png',
+                    w, h, pix_fmt, 30, with_vidcap == 'apng'
+                )
+            elif with_vidcap == 'pipe':
                 import shlex, subprocess
-                args = shlex.split(vidcap_pipe_cmd)
+                args = shlex.split(vidcap_pipe_cmd % {'pix_fmt': pix_fmt})
                 self.ffpipe = subprocess.Popen(args, bufsize=-1,
                                           stdin=subprocess.PIPE)
                 self.video_outfp = self.ffpipe.stdin
+            elif vidcap_delta:
+                self.video_outfp = open('vtee.dlt', 'wb')
+                self.display.set_capture_delta()
             else:
                 self.video_outfp = open('vtee.raw', 'wb')
                 # convert this with
                 # avconv -f rawvideo -r 30 -pix_fmt rgb24 -s 256x176 -y -an -i vtee.raw -c:v png vtee.avi
+                # (with -pix_fmt from capture_pix_fmt() if not RGB)
                 # or see http://www.iabaldwin.com/2011/02/piping-raw-data-info-ffmpeg/
-            self.display.set_videotee(self.video_outfp, 2)
+            self.display.set_videotee(self.video_outfp, 2, vidcap_queue_frames,
+                                      vidcap_drop_frames)
         self.last_vkeys = 0xFF
+        self.input_log = None
+        self.rewind = None
+        self.perf_hud = False
+        self.perf_stats = self.perf_csvfp = None
+        if perf_csv_filename:
+            from perf import FrameStats
+            self.perf_csvfp = open(perf_csv_filename, 'w')
+            self.perf_stats = FrameStats(play_phases, perf_window, self.perf_csvfp)
+        self.metrics_fp = None
+        if metrics_filename:
+            self.metrics_fp = open(metrics_filename, 'w')
+            metrics.enable()
+
+    def toggle_perf_hud(self):
+        """Show or hide phase times.  Return the new perf_stats."""
+        from perf import FrameStats
+
+        self.perf_hud = not self.perf_hud
+        if self.perf_hud and not self.perf_stats:
+            self.perf_stats = FrameStats(play_phases, perf_window)
+        elif not self.perf_hud and not self.perf_csvfp:
+            self.perf_stats = None
+        return self.perf_stats
+
+    def write_metrics(self, record):
+        import json
+        self.metrics_fp.write(json.dumps(record, sort_keys=True))
+        self.metrics_fp.write("\n")
+
+    def draw_perf_hud(self, game):
+        """Draw phase times in the top left corner.  Return its rect."""
+        lines = self.perf_stats.report()
+        dst = self.display.get_surface()
+        rect = G.Rect(0, 0, 8 * max(len(line) for line in lines), 8 * len(lines))
+        dst.fill((0, 0, 0), rect)
+        for (i, line) in enumerate(lines):
+            self.font.textout(dst, line, 0, 8 * i)
+        # Erase it next frame in case it's hidden
+        game.pf.setdirtyrects([rect], 0)
+        return rect
 
     def draw(self, game):
         from itertools import chain
@@ -239,39 +353,150 @@ class FHBGView(object):
             spr_rects.extend(game.chip_factory.draw(pfdst))
         spr_rects.extend(game.player.draw(pfdst))
         pf.setdirtyrects(spr_rects, 0)
-##        new_dirty = pf.getdirtyruns()
-##        all_dirty = pf.unionoldnewdirty(old_dirty, new_dirty)
-##        to_update = pf.dirtyrunstorects(all_dirty)
+        new_dirty = pf.getdirtyruns()
+        all_dirty = pf.unionoldnewdirty(old_dirty, new_dirty)
+        return pf.dirtyrunstorects(all_dirty)
 
     def close(self):
         if self.video_outfp:
             G.display.set_caption("Waiting for encode to finish")
             G.display.get_surface().fill((102, 102, 102))
             G.display.flip()
-            self.video_outfp.close()
-            self.video_outfp = None
+            try:
+                videotee = self.display.close_videotee()
+            finally:
+                # Even if a write failed, close the file and let the
+                # encoder see the end of its input before re-raising
+                video_outfp, self.video_outfp = self.video_outfp, None
+                try:
+                    video_outfp.close()
+                    if (self.display.pixel_format == 'P'
+                        and not self.display.pal8_inline_palette):
+                        with open('vtee.pal', 'wb') as outfp:
+                            outfp.write(self.display.capture_palette_bytes())
+                finally:
+                    if self.ffpipe:
+                        self.ffpipe.wait()
+                        self.ffpipe = None
+            print("Captured %d %s frames, dropped %d"
+                  % (videotee.frames_written, self.display.capture_pix_fmt(),
+                     videotee.frames_dropped))
             chipsfx.render_logged_fx(sfxdata, self.display.num_frames)
         elif self.display:
             self.display.get_surface().fill((102, 102, 102))
             self.display.flip()
         self.display = self.font = self.sfx = self.spritegfx = None
-        if self.ffpipe:
-            self.ffpipe.wait()
-            self.ffpipe = None
+        if self.perf_csvfp:
+            self.perf_csvfp.close()
+            self.perf_csvfp = self.perf_stats = None
+        if self.metrics_fp:
+            metrics.enable(False)
+            self.metrics_fp.close()
+            self.metrics_fp = None
 
     def __del__(self):
         self.close()
 
+_slot_names = {}
+
+def _fields(obj):
+    """Return a dict of an object's attributes, both those in its
+__dict__ and those in __slots__ of its class and base classes."""
+    cls = type(obj)
+    try:
+        names = _slot_names[cls]
+    except KeyError:
+        names = _slot_names[cls] = tuple(
+            name for base in cls.__mro__
+            for name in base.__dict__.get('__slots__', ())
+        )
+    out = dict(getattr(obj, '__dict__', ()))
+    for name in names:
+        try:
+            out[name] = getattr(obj, name)
+        except AttributeError:
+            pass
+    return out
+
+def _checksum_fields(obj, out):
+    """Append an object's numeric attributes to out in a fixed order."""
+    for name, value in sorted(_fields(obj).items()):
+        if isinstance(value, (int, float)):
+            out.append(value)
+        elif isinstance(value, list):
+            out.append(len(value))
+            out.extend(v for v in value if isinstance(v, (int, float)))
+        elif value is None:
+            out.append(-1)
+
+def _snapshot_value(value, memo):
+    """Convert a value of game state to data that marshal can save.
+
+Objects become a dict of their attributes with the class name under
+''.  An object already in memo, such as the game or view or a
+ChipCritter's factory, becomes {'@': its index in memo}.
+
+"""
+    if isinstance(value, list):
+        return [_snapshot_value(v, memo) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_snapshot_value(v, memo) for v in value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    try:
+        return {'@': memo[id(value)]}
+    except KeyError:
+        pass
+    memo[id(value)] = len(memo)
+    out = dict((name, _snapshot_value(v, memo))
+               for name, v in _fields(value).items())
+    out[''] = type(value).__name__
+    return out
+
+def _restore_value(value, memo, classes):
+    """Undo _snapshot_value().  memo is a list of objects."""
+    if isinstance(value, list):
+        return [_restore_value(v, memo, classes) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_restore_value(v, memo, classes) for v in value)
+    if not isinstance(value, dict):
+        return value
+    if '@' in value:
+        return memo[value['@']]
+    cls = classes[value['']]
+    obj = cls.__new__(cls)
+    memo.append(obj)
+    for name, v in value.items():
+        if name:
+            setattr(obj, name, _restore_value(v, memo, classes))
+    return obj
+
 class FHBGGame(object):
-    def __init__(self, view, levelmaps=None, levels=None):
+    # Attributes that snapshot() saves some other way or not at all
+    snapshot_skip = ('view', 'rng', 'pf', 'levelmaps', 'levels',
+                     'player_projectile_grid')
+    snapshot_version = 1
+
+    def __init__(self, view, levelmaps=None, levels=None, seed=None):
+        """
+
+seed -- the seed for self.rng, which everything random in the game
+uses, including the background patterns of maps loaded from
+levels.ini; None seeds from the system
+
+"""
+        self.rng = random.Random(seed)
         if not levelmaps or not levels:
-            levelmaps, levels = loadlevel.load_levels()
+            levelmaps, levels = loadlevel.load_levels(rng=self.rng)
         self.levelmaps, self.levels = levelmaps, levels
         self.view = view
+        # Rebuilt each frame once player projectiles have moved, for
+        # critters' stun tests
+        self.player_projectile_grid = SpatialGrid(cellsize=TILE)
 
     def new_game(self):
         from player import Player
-        self.pf = mtplane.MetatilePlane()
+        self.pf = mtplane.MetatilePlane(flagtable=loadlevel.mtflags)
         self.player = Player(self, self.view, 1, 9)
         self.cleared_levels = 0
         self.outer_y = 0
@@ -308,7 +533,7 @@ class FHBGGame(object):
         if mapstart:
             p_x, p_y = mapstart
             self.exitpos = p_x, p_y
-            self.player.pos = [p_x * 16 + 8, p_y * 16 + 15]
+            self.player.pos = [(p_x * 16 + 8) * PX, (p_y * 16 + 15) * PX]
             self.pf.setcol(p_x, p_y - 1, (12, 13))
         else:
             p_x, p_y = 8, 9
@@ -319,9 +544,15 @@ class FHBGGame(object):
 
         return p_x, p_y
 
-    def move(self, vkeys, new_vkeys):
-        from itertools import chain
+    def move(self, vkeys, new_vkeys, lap=None):
+        """Run one frame of game logic.
+
+lap -- if not None, called with 'player', 'enemy', 'projectile', or
+'chip' after each phase of the frame (see perf.PhaseTimer.lap)
+
+"""
         self.player.move(vkeys, new_vkeys)
+        lap and lap('player')
         want_to_open_door = False
 
         try:
@@ -332,47 +563,211 @@ class FHBGGame(object):
         else:
             if next_enemy:
                 self.enemies.append(next_enemy)
-        self.player_projectiles = [t for t in self.player_projectiles if t and t.pos]
-        self.enemy_projectiles = [t for t in self.enemy_projectiles if t and t.pos]
-        for t in chain(self.player_projectiles, self.enemies, self.enemy_projectiles):
+        lap and lap('enemy')
+        compact(self.player_projectiles)
+        compact(self.enemy_projectiles)
+        for t in self.player_projectiles:
+            t.move()
+        self.player_projectile_grid.rebuild(self.player_projectiles)
+        lap and lap('projectile')
+        for t in self.enemies:
+            t.move()
+        lap and lap('enemy')
+        for t in self.enemy_projectiles:
             t.move()
+        lap and lap('projectile')
         if self.chip_factory and self.chip_factory.move():
             want_to_open_door = True
             self.chip_factory = None
+        lap and lap('chip')
 
         if want_to_open_door:
             chipsfx.fxq('opendoor')
             spawn_x, spawn_y = self.exitpos
             self.pf.setcol(spawn_x, spawn_y - 1, (14, 15))
 
+    def state_checksum(self):
+        """Return a CRC-32 of all state that carries into the next frame.
+
+Two runs of a level from the same seed with the same input should
+produce the same checksum after every frame.
+
+"""
+        import sys, zlib
+        from array import array
+        from itertools import chain
+
+        pf = self.pf
+        crc = zlib.crc32(pf.cells)
+        values = array('d', [self.spawn_time, len(self.enemies)])
+        objs = chain((self.player, self.enemy_factory, self.chip_factory),
+                     self.player_projectiles, self.enemies, self.enemy_projectiles,
+                     self.chip_factory.chips if self.chip_factory else ())
+        for obj in objs:
+            if obj is None:
+                values.append(-1)
+            else:
+                values.append(zlib.crc32(type(obj).__name__.encode('ascii')))
+                _checksum_fields(obj, values)
+        rngstate = array('I', self.rng.getstate()[1])
+        if sys.byteorder != 'little':
+            values.byteswap()
+            rngstate.byteswap()
+        crc = zlib.crc32(values.tobytes(), crc)
+        return zlib.crc32(rngstate.tobytes(), crc)
+
+    def snapshot(self):
+        """Save all state that carries into the next frame as bytes.
+
+The playfield's cells, the RNG state, and the critters' attributes
+are saved as plain data with marshal, not pickled.  References to
+the game and view are saved as such, so restore() can bind the
+critters to whatever game and view it runs in.
+
+"""
+        import marshal, sys
+        from array import array
+
+        memo = {id(self): 0, id(self.view): 1}
+        state = dict((name, _snapshot_value(value, memo))
+                     for name, value in vars(self).items()
+                     if name not in self.snapshot_skip)
+        rngversion, rngstate, gauss_next = self.rng.getstate()
+        rngstate = array('I', rngstate)
+        if sys.byteorder != 'little':
+            rngstate.byteswap()
+        return marshal.dumps((self.snapshot_version, bytes(self.pf.cells),
+                              (rngversion, rngstate.tobytes(), gauss_next),
+                              state))
+
+    def restore(self, data):
+        """Put the game back in the state saved by snapshot().
+
+The whole playfield is marked dirty so that the next draw
+replaces everything on the screen.
+
+"""
+        import marshal, sys
+        from array import array
+        import enemy, player
+
+        version, cells, rngstate, state = marshal.loads(data)
+        if version != self.snapshot_version:
+            raise ValueError("snapshot version %d is not %d"
+                             % (version, self.snapshot_version))
+        classes = dict((name, cls)
+                       for module in (enemy, player)
+                       for name, cls in vars(module).items()
+                       if isinstance(cls, type))
+        if getattr(self, 'pf', None) is None:
+            self.pf = mtplane.MetatilePlane(flagtable=loadlevel.mtflags)
+        memo = [self, self.view]
+        for name, value in state.items():
+            setattr(self, name, _restore_value(value, memo, classes))
+        self.pf.setcells(cells)
+        self.pf.cleardirty(True)
+        rngversion, rngbytes, gauss_next = rngstate
+        rngstate = array('I')
+        rngstate.frombytes(rngbytes)
+        if sys.byteorder != 'little':
+            rngstate.byteswap()
+        self.rng.setstate((rngversion, tuple(rngstate), gauss_next))
+
+def level_done(game, vkeys):
+    """Decide whether a frame of play ended the level.
+
+Return 'esc', 'door', 'side', 'die', or False.
+
+"""
+    p = game.player
+    if (vkeys & (VK_SELECT | VK_START) == (VK_SELECT | VK_START)):
+        return 'esc'
+    if p.state == p.ST_ENTERING_DOOR and p.walking_frame > 20:
+        return 'door'
+    if (vkeys & VK_RIGHT) and game.open_r and p.pos[0] >= 248 * PX:
+        return 'side'
+    if (vkeys & VK_LEFT) and game.open_l and p.pos[0] <= 8 * PX:
+        return 'side'
+    if p.health < 1:
+        return 'die'
+    return False
+
 def play_level(view, game, level=None, mapentry=None):
+    log = view.input_log
+    if view.metrics_fp:
+        # Forget what menus and the like did before the level
+        metrics.end_frame()
+        metrics.end_level()
+    if log is not None:
+        seed = game.rng.getrandbits(32)
+        game.rng.seed(seed)
+        log.begin_segment(game, level, mapentry, seed)
     game.new_level(level, mapentry)
-    p = game.player
     done = False
     clk = G.time.Clock()
     addlkeys = [
         (G.K_ESCAPE, 0, VK_SELECT|VK_START)
     ]
+    rewind = view.rewind
+    if rewind is not None:
+        rewind.clear()
+    stats = view.perf_stats
+    lap = stats.lap if stats else None
     while not done:
+        lap and stats.start()
         event_vkeys, other_events = translate_events(addlkeys)
+        for e in other_events:
+            if e.type == G.KEYDOWN and e.key == perf_hud_key:
+                stats = view.toggle_perf_hud()
+                lap = stats.lap if stats else None
+                lap and stats.start()
         (vkeys, new_vkeys) = read_pads(view)
         new_vkeys |= event_vkeys
         vkeys |= event_vkeys
-        game.move(vkeys, new_vkeys)
-        view.draw(game)
-        if p.health < 1:
-            done = 'die'
-        if (vkeys & VK_LEFT) and game.open_l and p.pos[0] <= 8:
-            done = 'side'
-        if (vkeys & VK_RIGHT) and game.open_r and p.pos[0] >= 248:
-            done = 'side'
-        if p.state == p.ST_ENTERING_DOOR and p.walking_frame > 20:
-            done = 'door'
-        if (vkeys & (VK_SELECT | VK_START) == (VK_SELECT | VK_START)):
-            done = 'esc'
+        lap and lap('input')
+        if (rewind is not None
+            and vkeys & (VK_SELECT | VK_START) == VK_SELECT):
+            snapshot = rewind.pop()
+            if snapshot is not None:
+                game.restore(snapshot)
+                if log is not None:
+                    # The log can't represent going back in time, so
+                    # drop this level from the log
+                    log.segments.pop()
+                    log = None
+            lap and lap('rewind')
+            to_update = view.draw(game)
+        else:
+            game.move(vkeys, new_vkeys)
+            lap and lap('move')
+            if rewind is not None:
+                rewind.push(game.snapshot())
+                lap and lap('rewind')
+            to_update = view.draw(game)
+            lap and lap('draw')
+            if log is not None:
+                log.log(vkeys, new_vkeys, game.state_checksum())
+                lap and lap('log')
+            done = level_done(game, vkeys)
+            lap and lap('move')
+        if view.perf_hud:
+            to_update.append(view.draw_perf_hud(game))
+        lap and lap('draw')
         chipsfx.fxq_play(view.sfx, view.display.num_frames)
+        lap and lap('sfx')
         clk.tick(60)
-        view.display.flip()
+        lap and lap('tick')
+        view.display.flip(to_update)
+        if lap:
+            lap('flip')
+            stats.end_frame()
+        if view.metrics_fp:
+            view.write_metrics({'frame': view.display.num_frames,
+                                'counts': metrics.end_frame()})
+    if view.metrics_fp:
+        num_frames, counts = metrics.end_level()
+        view.write_metrics({'level': level[0] if level else mapentry[0],
+                            'frames': num_frames, 'counts': counts})
     return done
 
 def ilog2(i):
@@ -413,16 +808,25 @@ assert ilog2(0) < 0
 assert ilog2(1) == 0
 assert ilog2(2) == 1
 
+def start_replay_log(view):
+    from replay import InputLog
+    view.input_log = InputLog() if with_replay_log else None
+
+def save_replay_log(view):
+    if view.input_log and view.input_log.segments:
+        view.input_log.save(replay_filename)
+    view.input_log = None
+
 num_floors = 3
 
 def play_game(view, game):
     from fhbgui import preroll, gameover
     game.new_game()
     game.pf.sheet = view.metatile_sheet
-    game.player.pos = [2 * 16 + 8, 159]
+    game.player.pos = [(2 * 16 + 8) * PX, 159 * PX]
 
     while True:
-        game.player.pos[1] = (1 - game.outer_y % 2) * 80 + 79
+        game.player.pos[1] = ((1 - game.outer_y % 2) * 80 + 79) * PX
         floors_done = clz(~game.cleared_levels) // 4
         open_elevator = (game.outer_y & 1
                          if game.outer_y + 1 == floors_done
@@ -443,16 +847,16 @@ def play_game(view, game):
         if result == 'esc':
             gameover(view, count_ones(game.cleared_levels))
             return
-        side = 1 if game.player.pos[0] >= 128 else 0
+        side = 1 if game.player.pos[0] >= 128 * PX else 0
         if result == 'side':
             if game.outer_x == 1 and side == 1:
                 game.outer_y = (game.outer_y + 1) % num_floors
-                game.player.pos[0] = 232
+                game.player.pos[0] = 232 * PX
                 continue
             if game.outer_x == 0 and side == 0:
                 return 'win'
             game.outer_x = side
-            game.player.pos[0] = 8 if side else 248
+            game.player.pos[0] = (8 if side else 248) * PX
             continue
 
         levelnum = game.outer_y * 4 + game.outer_x * 2 + side
@@ -467,11 +871,12 @@ def play_game(view, game):
             return
         game.cleared_levels |= 1 << levelnum
         new_xpos = (levelnum & 1) * 7 - (game.outer_x & 1) + 5
-        game.player.pos[0] = new_xpos * 16 + 8
+        game.player.pos[0] = (new_xpos * 16 + 8) * PX
             
 def main():
     from fhbgui import coprscreen, titlescreen, level_select
     from editor import editor
+    from rewind import RewindBuffer
 
     G.display.set_caption("Loading")
     joycfg.dump_joysticks(verbose=False)
@@ -544,7 +949,11 @@ def main():
                 if with_music:
                     G.mixer.music.set_volume(.7)
                     G.mixer.music.play(-1)
+                start_replay_log(view)
+                view.rewind = RewindBuffer(rewind_frames, rewind_bytes)
                 result = play_level(view, game, game.levels[ls_level])
+                view.rewind = None
+                save_replay_log(view)
                 G.mixer.music.stop()
                 if result == 'q':
                     quitting = True
@@ -558,7 +967,9 @@ def main():
         if with_music:
             G.mixer.music.set_volume(.7)
             G.mixer.music.play(-1)
+        start_replay_log(view)
         result = play_game(view, game)
+        save_replay_log(view)
         G.mixer.music.stop()
         if result == 'q':
             quitting = True
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Run the game rules with no display, no mixer, and no frame pacing.
+
+usage: headless.py [-l LEVEL] [-n FRAMES] [-s SCRIPT] [--seed SEED] [-m]
+
+Plays a level from levels.ini using a scripted controller and
+reports how many frames per second the simulation itself can run,
+along with the time spent in each phase of FHBGGame.move().  The
+state checksum at the end is the same on every run with the same
+arguments.  With -m, it also reports the metrics.py counts.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import chipsfx, metrics
+from events import VK_A, VK_B, VK_UP, VK_DOWN, VK_LEFT, VK_RIGHT
+
+script_buttons = {
+    'U': VK_UP, 'D': VK_DOWN, 'L': VK_LEFT, 'R': VK_RIGHT,
+    'A': VK_A, 'B': VK_B, '.': 0
+}
+
+# Walk back and forth, making and throwing blocks and jumping
+demo_script = """
+B R*24 RA R*12 B R*30 .*4 B .*8 B L*24 LA L*20 B L*30 .*4 B .*8 B
+U .*6 A .*30 R*8 RA R*40 .*2 B L*8 B .*20
+"""
+
+def parse_script(script):
+    """Convert a controller script to a list of vkeys, one per frame.
+
+A script is whitespace-separated steps.  Each step is the buttons
+held, from UDLRAB, or . for none, optionally followed by * and a
+number of frames.  "R*20 RA B" holds Right for 20 frames, then
+Right and A for one frame, then B for one frame.
+
+"""
+    out = []
+    for step in script.split():
+        buttons, _, count = step.partition('*')
+        vkeys = 0
+        for c in buttons.upper():
+            vkeys |= script_buttons[c]
+        out.extend([vkeys] * (int(count) if count else 1))
+    return out
+
+class NullSurface(object):
+    """Stands in for the screen.  Blits draw nothing."""
+
+    def blit(self, src, dstpos, area=None):
+        return (dstpos[0], dstpos[1], area[2], area[3]) if area else None
+
+class HeadlessView(object):
+    """A view with no display, mixer, or graphics.
+
+Critters keep a reference to the view for drawing.  Some draw()
+methods also advance state that the game rules read, such as the
+player's throwing pose and how long a Poof lives, so draw() still
+calls each of them with a NullSurface.
+
+"""
+    def __init__(self):
+        self.display = self.sfx = None
+        self.spritegfx = [None] * 4
+        self.metatile_sheet = None
+        self.screen = NullSurface()
+        self.last_vkeys = 0xFF
+
+    def draw(self, game):
+        from itertools import chain
+        dst = self.screen
+        for t in chain(game.enemy_projectiles, game.enemies, game.player_projectiles):
+            t.draw(dst)
+        if game.chip_factory:
+            game.chip_factory.draw(dst)
+        game.player.draw(dst)
+        return []
+
+    def close(self):
+        pass
+
+def run_headless(game, level, vkeys_source, num_frames, timer=None):
+    """Play num_frames frames of a level as fast as possible.
+
+game -- an FHBGGame whose view is a HeadlessView
+level -- an entry of game.levels
+vkeys_source -- iterable of vkeys, one per frame
+timer -- a perf.PhaseTimer to receive per-phase times, or None
+
+Whenever the player dies or leaves, start the level over.
+Return the number of times the level was started.
+
+"""
+    from fhbg import level_done
+
+    view = game.view
+    lap = timer.lap if timer else None
+    vkeys_source = iter(vkeys_source)
+    starts = 0
+    done = True
+    if timer:
+        timer.start()
+    for frame in range(num_frames):
+        if done:
+            game.new_game()
+            game.new_level(level)
+            starts += 1
+            lap and lap('level')
+        vkeys = next(vkeys_source)
+        new_vkeys = vkeys & ~view.last_vkeys
+        view.last_vkeys = vkeys
+        game.move(vkeys, new_vkeys, lap)
+        view.draw(game)
+        chipsfx.fxq_clear()
+        done = level_done(game, vkeys)
+        lap and lap('draw')
+        metrics.enabled and metrics.end_frame()
+    return starts
+
+def main(argv=None):
+    import argparse
+    from itertools import cycle
+    from fhbg import FHBGGame
+    from perf import PhaseTimer
+
+    parser = argparse.ArgumentParser(description="Benchmark the game rules with no display.")
+    parser.add_argument('-l', '--level', type=int, default=1,
+                        help="level number in levels.ini, starting at 1")
+    parser.add_argument('-n', '--frames', type=int, default=10000,
+                        help="number of frames to simulate")
+    parser.add_argument('-s', '--script', default=demo_script,
+                        help="controller script, such as 'R*20 RA B'")
+    parser.add_argument('--seed', type=int, default=1,
+                        help="seed for the game's random number generator")
+    parser.add_argument('-m', '--metrics', action='store_true',
+                        help="count blits, collision tests, and the like")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+
+    view = HeadlessView()
+    game = FHBGGame(view, seed=args.seed)
+    level = game.levels[args.level - 1]
+    timer = PhaseTimer()
+    starts = run_headless(game, level, cycle(parse_script(args.script)),
+                          args.frames, timer)
+    elapsed = timer.total()
+    print("%s: %d frames, %d starts, %.3f s"
+          % (level[0], args.frames, starts, elapsed))
+    print("%.0f simulated frames per second (%.1fx real time)"
+          % (args.frames / elapsed, args.frames / elapsed / 60))
+    print("\n".join(timer.report(args.frames)))
+    if args.metrics:
+        num_frames, counts = metrics.end_level()
+        print("\n".join(metrics.report(num_frames, counts)))
+    print("state checksum %08x" % game.state_checksum())
+
+if __name__=='__main__':
+    main()
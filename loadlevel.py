@@ -32,6 +32,18 @@ mttable = bytes([
  0xF4,0x04,0xF4,0x04, 0x07,0x06,0x07,0x07, 0x05,0x04,0x06,0x05, 0x04,0x04,0x04,0x04
 ])
 
+# Flags for MetatilePlane.flagrows, which keeps a bitmask per row
+# of the cells having each flag
+MTF_BLOCK = 0x01          # 16-31: solid to everything
+MTF_LADDER = 0x02         # 8: climbable, and solid from above
+MTF_ELEVATOR_DOOR = 0x04  # 44: solid until the elevator opens
+MTF_FLOOR = 0x08          # 8 or 16+: a walker won't drive off it
+mtflags = bytes((MTF_BLOCK if 16 <= t < 32 else 0)
+                | (MTF_LADDER if t == MT_LADDER else 0)
+                | (MTF_ELEVATOR_DOOR if t == MT_ELEVATOR_DOOR else 0)
+                | (MTF_FLOOR if t >= 16 or t == MT_LADDER else 0)
+                for t in range(256))
+
 mtmap_fluoro = bytes([6, 4,
  0x03,0x20,0x21,0x22,0x23,0x03,
  0x03,0x24,0x00,0x00,0x25,0x03,
@@ -108,8 +120,15 @@ def connect_level(level):
             level[x] |= 4
             level[x + 16] |= 1
 
-def randomize_level_bg(level):
-    from random import choice
+def randomize_level_bg(level, rng=None):
+    """Scatter background patterns through the empty cells of a map.
+
+rng -- a random.Random, or None to use the random module
+
+"""
+    if rng is None:
+        import random as rng
+    choice = rng.choice
 
     for y in range(0, len(level), 16):
         for x in range(y, y + 15):
@@ -139,8 +158,9 @@ def randomize_level_bg(level):
 class LevelsParser(innie.InnieParser):
     mtnums = {ord('#'): MT_LADDER, ord(' '): 0}
 
-    def __init__(self, data=None, filenames=None):
+    def __init__(self, data=None, filenames=None, rng=None):
         innie.InnieParser.__init__(self)
+        self.rng = rng
         self.maps = []
         self.maps_by_name = {}
         self.levels = []
@@ -167,7 +187,7 @@ class LevelsParser(innie.InnieParser):
             g = self.mtnums.get
             level = bytearray(g(c, 16) for c in b''.join(level))
             connect_level(level)
-            randomize_level_bg(level)
+            randomize_level_bg(level, self.rng)
             self.maps[-1][2] = level
         elif k == 'level':
             self.levels.append([v, None, 1, [], 0])
@@ -186,8 +206,8 @@ class LevelsParser(innie.InnieParser):
         else:
             return (k, v)
 
-def load_levels(filenames=None):
-    parser = LevelsParser(filenames=filenames or ['levels.ini'])
+def load_levels(filenames=None, rng=None):
+    parser = LevelsParser(filenames=filenames or ['levels.ini'], rng=rng)
     return (parser.maps, parser.levels)
 
 def save_levels(filename, maps, levels):
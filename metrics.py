@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Count what each frame did.
+
+Hot paths call add(name) when enabled is True, in the same style as
+FHBGGame.move() calls lap:
+
+    metrics.enabled and metrics.add('raycast')
+
+so counting costs one attribute test per call while it's off.  The
+counters are:
+
+blit.draw16, blit.redrawdirty, blit.textout -- Surface.blit() calls
+dirty.runs, dirty.tiles -- runs and tiles returned by getdirtyruns()
+four_corner_collide, raycast -- calls
+stun_test.pairs -- critter-projectile pairs that stun_test() checked
+new.TossedBlock, new.Poof, new.Toast, new.FloatingDigit -- objects
+    created because their class's free list was empty
+reuse.TossedBlock, reuse.Poof, reuse.Toast, reuse.FloatingDigit --
+    dead objects taken from the free list instead
+gc.gen0, gc.gen1, gc.gen2 -- cyclic garbage collections of each
+    generation, which pause the game
+
+Once every free list has filled, play should count no new.* and
+few if any gc.* per frame.
+
+Call end_frame() once per frame to get that frame's counts, and
+end_level() to get the totals since the last end_level().
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import gc
+from collections import Counter
+
+enabled = False
+frame_counts = Counter()
+level_counts = Counter()
+level_frames = 0
+
+def add(name, n=1):
+    frame_counts[name] += n
+
+def _count_gc(phase, info):
+    if phase == 'start':
+        frame_counts['gc.gen%d' % info['generation']] += 1
+
+def enable(on=True):
+    """Start or stop counting, and forget all counts."""
+    global enabled, level_frames
+    enabled = on
+    if _count_gc in gc.callbacks:
+        gc.callbacks.remove(_count_gc)
+    if on:
+        gc.callbacks.append(_count_gc)
+    frame_counts.clear()
+    level_counts.clear()
+    level_frames = 0
+
+def end_frame():
+    """Return this frame's counts as a dict and start the next frame."""
+    global level_frames
+    out = dict(frame_counts)
+    level_counts.update(frame_counts)
+    level_frames += 1
+    frame_counts.clear()
+    return out
+
+def end_level():
+    """Return (number of frames, dict of total counts) since the last
+end_level() and start counting the next level."""
+    global level_frames
+    out = level_frames, dict(level_counts)
+    level_counts.clear()
+    level_frames = 0
+    return out
+
+def report(num_frames, counts):
+    """Return lines of each count's total and mean per frame."""
+    num_frames = max(1, num_frames)
+    return ["%-20s%9d%9.2f/frame" % (name, counts[name], counts[name] / num_frames)
+            for name in sorted(counts)]
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import pygame as G
+import metrics
 
 class MetatilePlane(object):
     """
@@ -18,10 +19,36 @@ The order of operations:
 8. pygame.display.update() these coordinates.
 
 """
-    def __init__(self, height=12, tw=16, th=16):
-        # Store cells as two 16x12 blocks because it's shared with NES
-        self.cells = [[[0] * 16 for y in range(height)] for pg in (0, 1)]
+    def __init__(self, height=12, tw=16, th=16, flagtable=None):
+        """
+
+flagtable -- a 256-byte table of flag bits for each tile number,
+    or None; see flagrows
+
+"""
+        # Store cells and dirty flags one byte per tile, 32 tiles to
+        # a row, so that a row of dirty flags can be searched with
+        # find() and a rectangle marked with slice assignment.  The
+        # NES splits cells into two 16x12 pages, but Python need not.
+        self.height = height
+        self.cells = bytearray(32 * height)
+
+        # flagrows[flag][y] has bit x set if flagtable[getcell(x, y)]
+        # has flag set, so that collision code can test a row of
+        # cells with a mask and a shift instead of a getcell() each
+        self.flagtable = flagtable
+        self.flagrows = {}
+        for flag in (1 << i for i in range(8)) if flagtable else ():
+            if any(f & flag for f in flagtable):
+                allrow = 0xFFFFFFFF if flagtable[0] & flag else 0
+                self.flagrows[flag] = [allrow] * height
+        self.dirty = bytearray(32 * height)
+        self.alldirty = b'\x01' * (32 * height)
+        self.allclean = bytes(32 * height)
         self.sheet = None
+        # Every cell pre-rendered, so that erasing a dirty run
+        # is one blit instead of one per tile
+        self.bgcache = self.bgcache_sheet = None
         self.cleardirty(True)
         self.win_x = 0
         self.tw = tw
@@ -30,22 +57,44 @@ The order of operations:
 
     def cleardirty(self, val):
         """Set dirty values of all tiles to True or False."""
-        val = bool(val)
-        # Store dirty as 32x12 because only Python needs it
-        self.dirty = [[val] * 32 for i in range(len(self.cells[0]))]
+        self.dirty[:] = self.alldirty if val else self.allclean
 
     def getcell(self, x, y):
-        x = x % 32
-        tbl = self.cells[1 if x >= 16 else 0]
-        return tbl[y][x % 16]
+        return self.cells[y * 32 + x % 32]
+
+    def getflag(self, flag, x, y):
+        """Return 1 if flagtable gives the cell at (x, y) flag, else 0."""
+        return (self.flagrows[flag][y] >> (x % 32)) & 1
 
     def setcell(self, x, y, value):
         x = x % 32
-        tbl = self.cells[1 if x >= 16 else 0]
-        tbl[y][x % 16] = value
-        self.dirty[y][x] = True
+        i = y * 32 + x
+        if self.flagtable:
+            changed = self.flagtable[self.cells[i]] ^ self.flagtable[value]
+            for flag, rows in self.flagrows.items() if changed else ():
+                if changed & flag:
+                    rows[y] ^= 1 << x
+        self.cells[i] = value
+        self.dirty[i] = 1
+        if self.bgcache is not None:
+            self.drawcell(self.bgcache, x * self.tw, y * self.th, value)
+
+    def setcells(self, cells):
+        """Replace all cells, such as with a copy of another plane's cells.
+
+Only cells that differ are set, so bgcache and flagrows stay
+current without being rebuilt.
+
+"""
+        old = self.cells
+        if old != cells:
+            for i, value in enumerate(cells):
+                if old[i] != value:
+                    self.setcell(i % 32, i // 32, value)
 
     def getrow(self, xmin, xmax, y):
+        if 0 <= xmin <= xmax <= 32 and 0 <= y < self.height:
+            return list(self.cells[y * 32 + xmin:y * 32 + xmax])
         return [self.getcell(x, y) for x in range(xmin, xmax)]
 
     def setrow(self, x, y, it):
@@ -77,54 +126,89 @@ Useful for scheduling a sprite to be erased in a dirty-rect environment.
         if y < 0:
             h -= y
             y = 0
-        if h > len(self.dirty) - y:
-            h = len(self.dirty) - y
+        if h > self.height - y:
+            h = self.height - y
+        if w <= 0 or h <= 0:
+            return
         leftw = max(0, x + w - 32)
         w -= leftw
-        for row in self.dirty[y:y + h]:
+        d, ones = self.dirty, self.alldirty
+        for i in range(y * 32, (y + h) * 32, 32):
             if leftw:
-                row[:leftw] = [True] * leftw
-            row[x:x + w] = [True] * w
+                d[i:i + leftw] = ones[:leftw]
+            d[i + x:i + x + w] = ones[:w]
 
     def setdirtyrects(self, rects, xscroll=0, yscroll=0):
         sdr = self.setdirtyrect
         for (x, y, w, h) in rects:
             sdr(x + xscroll, y + yscroll, w, h)
 
-    def redrawdirty(self, dst, xscroll=0, yscroll=0):
+    def drawcell(self, dst, x, y, tileno):
+        """Draw one metatile from the sheet with its top left at (x, y)."""
         tw, th = self.tw, self.th
         nperrow = self.sheet.get_width() // tw
-        for (yt, row) in enumerate(self.dirty):
-            row_dsty = yt * th - yscroll
-            for (xt, d) in enumerate(row):
-                if not d:
-                    continue
-                tileno = self.cells[1 if xt >= 16 else 0][yt][xt % 16]
-                srcarea = G.rect.Rect(tileno % nperrow * tw,
-                                      tileno // nperrow * th,
-                                      tw, th)
-                dstpos = (((xt + 1) * tw - xscroll) % (32 * tw) - tw, row_dsty)
-                dst.blit(self.sheet, dstpos, srcarea)
+        srcarea = (tileno % nperrow * tw, tileno // nperrow * th, tw, th)
+        dst.blit(self.sheet, (x, y), srcarea)
 
+    def render_bgcache(self):
+        """Draw every cell to bgcache, a surface the size of the whole map.
+
+setcell() keeps it current after that.  redrawdirty() calls this
+if the cache is missing or the sheet has changed.
+
+"""
+        self.bgcache = self.bgcache_sheet = None
+        if not self.sheet:
+            return
+        tw, th = self.tw, self.th
+        cache = G.Surface((32 * tw, self.height * th), 0, self.sheet)
+        for (i, tileno) in enumerate(self.cells):
+            self.drawcell(cache, i % 32 * tw, i // 32 * th, tileno)
+        self.bgcache, self.bgcache_sheet = cache, self.sheet
+
+    def redrawdirty(self, dst, xscroll=0, yscroll=0):
+        if self.bgcache is None or self.bgcache_sheet is not self.sheet:
+            self.render_bgcache()
+        tw, th = self.tw, self.th
+        mapw = 32 * tw
+        cache = self.bgcache
         dirtied = self.getdirtyruns()
+        for (yt, row) in enumerate(dirtied):
+            dsty = yt * th - yscroll
+            srcy = yt * th
+            for (xt, w) in row:
+                # Split a run that wraps around the right side
+                dstx = ((xt + 1) * tw - xscroll) % mapw - tw
+                w1 = min(w, -(-(mapw - tw - dstx) // tw))
+                dst.blit(cache, (dstx, dsty), (xt * tw, srcy, w1 * tw, th))
+                metrics.enabled and metrics.add('blit.redrawdirty')
+                if w1 < w:
+                    dst.blit(cache, (dstx + w1 * tw - mapw, dsty),
+                             ((xt + w1) * tw, srcy, (w - w1) * tw, th))
+                    metrics.enabled and metrics.add('blit.redrawdirty')
         self.cleardirty(False)
         return dirtied
 
     @staticmethod
-    def boolstoruns(row):
-        """Convert an iterable of booleans to an iterator of (start, length) tuples."""
-        # TO DO: test
-        runstart = None
-        for (x, pred) in enumerate(row):
-            if pred:
-                if runstart is None:
-                    runstart = x
-            else:
-                if runstart is not None:
-                    yield (runstart, x - runstart)
-                    runstart = None
-        if runstart is not None:
-            yield (runstart, x + 1 - runstart)
+    def boolstoruns(row, start=0, end=None):
+        """Convert a row of 0 and 1 bytes to an iterator of (start, length) tuples.
+
+row -- a bytes or bytearray, or any iterable of booleans
+start, end -- the slice of row to search; starts are relative
+    to start
+
+"""
+        if not isinstance(row, (bytes, bytearray)):
+            row = bytearray(1 if pred else 0 for pred in row)
+        if end is None:
+            end = len(row)
+        x = row.find(1, start, end)
+        while x >= 0:
+            runend = row.find(0, x, end)
+            if runend < 0:
+                runend = end
+            yield (x - start, runend - x)
+            x = row.find(1, runend, end)
 
     def getdirtyruns(self):
         """Get runs of dirty tiles for each row.
@@ -132,8 +216,13 @@ Useful for scheduling a sprite to be erased in a dirty-rect environment.
 Return a list of lists of (start, length) tuples.
 
 """
-        # TO DO: test
-        return [list(self.boolstoruns(row)) for row in self.dirty]
+        d, btr = self.dirty, self.boolstoruns
+        out = [list(btr(d, i, i + 32)) if d.find(1, i, i + 32) >= 0 else []
+               for i in range(0, len(d), 32)]
+        if metrics.enabled:
+            metrics.add('dirty.runs', sum(len(row) for row in out))
+            metrics.add('dirty.tiles', sum(w for row in out for (x, w) in row))
+        return out
 
     @staticmethod
     def unionruns(*seqs):
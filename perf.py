@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+from __future__ import with_statement, division, print_function, unicode_literals
+from time import perf_counter
+from collections import deque
+
+class PhaseTimer(object):
+    """Accumulate wall time spent in named phases of a frame.
+
+Call start() at the top of a frame, then lap(name) at the end of
+each phase.  Time since the previous mark is added to that phase's
+total, so a phase that runs in several pieces (such as projectiles,
+which move before and after the enemies) can lap more than once.
+
+"""
+    def __init__(self):
+        self.totals = {}
+        self.names = []
+        self.last = None
+
+    def start(self):
+        self.last = perf_counter()
+
+    def lap(self, name):
+        now = perf_counter()
+        try:
+            self.totals[name] += now - self.last
+        except KeyError:
+            self.totals[name] = now - self.last
+            self.names.append(name)
+        self.last = now
+
+    def total(self):
+        return sum(self.totals.values())
+
+    def report(self, num_frames):
+        """Return lines of per-phase time per frame in microseconds."""
+        num_frames = max(1, num_frames)
+        total = self.total() or 1
+        return ["%-11s%9.1f us/frame %5.1f%%"
+                % (name, self.totals[name] * 1e6 / num_frames,
+                   self.totals[name] * 100 / total)
+                for name in self.names]
+
+class FrameStats(object):
+    """Per-frame wall time of each phase over the last window frames.
+
+Call start() at the top of a frame, lap(name) at the end of each
+phase as with PhaseTimer, and end_frame() once the frame is shown.
+If csvfp is not None, each frame's times in milliseconds are also
+written to it as a CSV row.
+
+names -- the phases, in the order they are reported
+
+"""
+    def __init__(self, names, window=120, csvfp=None):
+        self.names = list(names)
+        self.times = dict((name, deque(maxlen=window)) for name in self.names)
+        self.frame = dict.fromkeys(self.names, 0.0)
+        self.last = None
+        self.num_frames = 0
+        self.csv = None
+        if csvfp:
+            import csv
+            self.csv = csv.writer(csvfp)
+            self.csv.writerow(['frame'] + self.names)
+
+    def start(self):
+        self.last = perf_counter()
+
+    def lap(self, name):
+        now = perf_counter()
+        self.frame[name] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        frame = self.frame
+        for name in self.names:
+            self.times[name].append(frame[name])
+        if self.csv:
+            self.csv.writerow([self.num_frames]
+                              + ["%.3f" % (frame[name] * 1000)
+                                 for name in self.names])
+        self.frame = dict.fromkeys(self.names, 0.0)
+        self.num_frames += 1
+
+    def summary(self):
+        """Return a list of (name, min, mean, 99th percentile) in seconds."""
+        out = []
+        for name in self.names:
+            times = sorted(self.times[name])
+            if not times:
+                continue
+            p99 = times[min(len(times) - 1, len(times) * 99 // 100)]
+            out.append((name, times[0], sum(times) / len(times), p99))
+        return out
+
+    def report(self):
+        """Return lines of min, mean, and 99th percentile in milliseconds."""
+        lines = ["phase  min  avg  p99"]
+        lines.extend("%-5s%5.1f%5.1f%5.1f" % (name[:5], lo * 1000, avg * 1000, p99 * 1000)
+                     for (name, lo, avg, p99) in self.summary())
+        return lines
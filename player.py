@@ -1,27 +1,32 @@
 #!/usr/bin/env python3
 from itertools import chain
 
-from enemy import BaseWalkingCritter, four_corner_collide
+from enemy import BaseWalkingCritter, four_corner_collide, PX, TILE, to_pixels
 from enemy import VK_A, VK_B, VK_UP, VK_DOWN, VK_LEFT, VK_RIGHT
 from chipsfx import fxq
+from entities import Pooled
 
-class TossedBlock(object):
-    def __init__(self, x, y, facing_left):
+class TossedBlock(Pooled):
+    __slots__ = ('pos', 'xvel', 'yvel')
+    free_list = []
+    sheet = None  # set by FHBGView
+
+    def reset(self, x, y, facing_left):
         self.pos = [x, y]
-        self.xvel = -2 if facing_left else 2
-        self.yvel = -5
+        self.xvel = -2 * PX if facing_left else 2 * PX
+        self.yvel = -5 * PX
 
     def move(self):
         self.pos[1] += self.yvel
         self.pos[0] += self.xvel
-        self.yvel += 1
-        if self.pos[1] > 176 or self.pos[0] < 4 or self.pos[0] > 252:
+        self.yvel += PX
+        if self.pos[1] > 176 * PX or self.pos[0] < 4 * PX or self.pos[0] > 252 * PX:
             self.pos = None
 
     def draw(self, screen):
         if not self.pos:
             return []
-        dstpos = (self.pos[0] - 4, self.pos[1] - 4)
+        dstpos = (to_pixels(self.pos[0]) - 4, to_pixels(self.pos[1]) - 4)
         srcarea = (0, 24, 8, 8)
         return [screen.blit(self.sheet, dstpos, srcarea)]
 
@@ -45,21 +50,21 @@ class Player(BaseWalkingCritter):
 
     def move(self, vkeys, new_vkeys):
         if (self.state == self.ST_WALKING and (new_vkeys & VK_UP)
-            and self.getblkat(self.pos[0], self.pos[1] - 16) == 9):
+            and self.getblkat(self.pos[0], self.pos[1] - 16 * PX) == 9):
             self.state = self.ST_ENTERING_DOOR
             self.walking_frame = 0
             return
         elif (self.state == self.ST_WALKING
-              and self.getblkat(self.pos[0], self.pos[1] - 8) == 15):
+              and self.getblkat(self.pos[0], self.pos[1] - 8 * PX) == 15):
             self.state = self.ST_ENTERING_DOOR
             self.walking_frame = 0
             return
         elif self.state == self.ST_ENTERING_DOOR:
-            ecks = self.pos[0] // 1 % 16 - 8
+            ecks = self.pos[0] // PX % 16 - 8
             if ecks < 0:
-                self.pos[0] += 1
+                self.pos[0] += PX
             elif ecks > 0:
-                self.pos[0] -= 1
+                self.pos[0] -= PX
             self.walking_frame += 1
             return
 
@@ -70,7 +75,7 @@ class Player(BaseWalkingCritter):
                 self.state = self.ST_THROWING
                 self.walking_frame = 0
                 self.carrying_block = False
-                blk = TossedBlock(self.pos[0], self.pos[1] - 28, self.facing_left)
+                blk = TossedBlock.acquire(self.pos[0], self.pos[1] - 28 * PX, self.facing_left)
                 self.game.player_projectiles.append(blk)
             elif self.state == self.ST_WALKING:
                 fxq('makeblock')
@@ -78,19 +83,20 @@ class Player(BaseWalkingCritter):
         if self.state == self.ST_THROWING:
             self.walking_frame += 64
 
-        self.pos[0] = min(248, max(8, self.pos[0]))
-        if self.pos[1] >= 192:
-            self.pos[1] -= 192
+        self.pos[0] = min(248 * PX, max(8 * PX, self.pos[0]))
+        if self.pos[1] >= 192 * PX:
+            self.pos[1] -= 192 * PX
 
         collidables = chain(self.game.enemies, self.game.enemy_projectiles)
         for e in collidables:
             if not e or not e.pos:
                 continue
             dx = e.pos[0] - self.pos[0]
-            dy = e.pos[1] - e.hitbox_height - self.pos[1] + self.hitbox_height
+            dy = (e.pos[1] - self.pos[1]
+                  + (self.hitbox_height - e.hitbox_height) * PX)
             if (not e.hitbox_width or not e.hitbox_height
-                or abs(dx) >= e.hitbox_width + self.hitbox_width
-                or abs(dy) >= e.hitbox_height + self.hitbox_height):
+                or abs(dx) >= (e.hitbox_width + self.hitbox_width) * PX
+                or abs(dy) >= (e.hitbox_height + self.hitbox_height) * PX):
                 continue
             destroyed = False
             if e.stun_time > 0:
@@ -102,9 +108,9 @@ class Player(BaseWalkingCritter):
                 destroyed = True
                 fxq('hurt')
             if destroyed:
-                self.yvel = min(self.yvel, -2)
+                self.yvel = min(self.yvel, -2 * PX)
                 from enemy import Poof
-                bullet = Poof(self.game, self.view, e.pos[0], e.pos[1])
+                bullet = Poof.acquire(self.game, self.view, e.pos[0], e.pos[1])
                 self.game.enemy_projectiles.append(bullet)
                 e.pos = None
 
@@ -127,18 +133,18 @@ class Player(BaseWalkingCritter):
                 self.state = self.ST_WALKING
         elif self.state == self.ST_JUMPING:
             f = (5 if self.carrying_block
-                 else 6 if self.yvel < -1
-                 else 7 if self.yvel < 1
+                 else 6 if self.yvel < -PX
+                 else 7 if self.yvel < PX
                  else 3)
         elif self.state == self.ST_HANGING:
             f = 8
         elif self.state == self.ST_ON_LADDER:
             f = 9
-            xflip = (int(self.pos[1] // 8) ^ int(self.pos[0] // 16)) & 1
+            xflip = (self.pos[1] // (8 * PX) ^ self.pos[0] // TILE) & 1
         elif self.state == self.ST_ENTERING_DOOR:
             f = 10
-        dstx = self.pos[0] - 8
-        dsty = self.pos[1] - [24, 23, 24, 23, 24, 23, 23, 23, 23, 24, 24][f]
+        dstx = to_pixels(self.pos[0]) - 8
+        dsty = to_pixels(self.pos[1]) - [24, 23, 24, 23, 24, 23, 23, 23, 23, 24, 24][f]
         if (self.mercy_time & 6) != 6:
             src = None
             srcx = [0, 16, 0, 32, 64, 80, 96, 112, 48, 80, 96][f]
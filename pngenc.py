@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Encode captured video frames as PNG or APNG without FFmpeg.
+
+PNGWriter takes the place of the vtee.raw file or the encoder pipe
+as the video tee's output.  Each frame it receives is compressed
+with zlib by a multiprocessing pool, so several frames compress at
+once on several cores, and the results are written in order either
+to one animated PNG or to a numbered sequence of PNG files.
+
+Frames may be rgb24, any 24- or 32-bit format from
+Enlarger.capture_pix_fmt() such as bgr0, or pal8 with the palette
+after the indices (Enlarger.pal8_inline_palette).  Frames in other
+formats are converted to RGB.  All frames of an APNG share the
+palette of the first frame, so an Enlarger capturing pal8 for one
+needs pal8_fixed_palette.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import struct, zlib
+from collections import deque
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+def png_chunk(chunktype, data):
+    return b''.join([
+        struct.pack('>I', len(data)), chunktype, data,
+        struct.pack('>I', zlib.crc32(chunktype + data) & 0xFFFFFFFF)
+    ])
+
+def frame_to_rows(frame, width, height, pix_fmt):
+    """Convert a captured frame to PNG scanlines.
+
+Return (color type, scanlines with filter bytes, PLTE data or None).
+
+"""
+    if pix_fmt == 'pal8':
+        pixels = frame[:width * height]
+        palette = bytearray(frame[width * height:width * height + 1024])
+        plte = bytearray(768)
+        plte[0::3] = palette[2::4]
+        plte[1::3] = palette[1::4]
+        plte[2::3] = palette[0::4]
+        colortype, bpp = 3, 1
+    else:
+        channels = pix_fmt[:-2] if pix_fmt.endswith('24') else pix_fmt
+        bpp = len(channels)
+        if channels == 'rgb':
+            pixels = frame[:width * height * 3]
+        else:
+            src = frame[:width * height * bpp]
+            pixels = bytearray(width * height * 3)
+            for i, c in enumerate('rgb'):
+                pixels[i::3] = src[channels.index(c)::bpp]
+        colortype, bpp, plte = 2, 3, None
+    pitch = width * bpp
+    rows = b''.join(b'\x00' + bytes(pixels[i:i + pitch])
+                    for i in range(0, height * pitch, pitch))
+    return colortype, rows, plte
+
+def encode_frame(frame, width, height, pix_fmt, level=6):
+    """Compress one frame.  Runs in a worker process.
+
+Return (color type, compressed image data, PLTE data or None).
+
+"""
+    colortype, rows, plte = frame_to_rows(frame, width, height, pix_fmt)
+    return colortype, zlib.compress(rows, level), plte and bytes(plte)
+
+class PNGWriter(object):
+    """A file-like object that encodes each write() as a PNG frame.
+
+filename -- the APNG to write, or if apng is False, a pattern
+    such as 'vtee%05d.png' for a sequence of PNG files
+fps -- frames per second, for APNG frame delays
+processes -- number of worker processes, None for one per core, or
+    0 to encode in the calling thread, as inside a worker process
+    that can't start its own pool
+level -- zlib compression level
+first_frame -- number of the first file of a PNG sequence
+
+"""
+    def __init__(self, filename, width, height, pix_fmt, fps=30, apng=True,
+                 processes=None, level=6, first_frame=0):
+        import multiprocessing
+
+        self.filename = filename
+        self.width, self.height = width, height
+        self.pix_fmt = pix_fmt
+        self.fps = fps
+        self.level = level
+        self.pool = multiprocessing.Pool(processes) if processes != 0 else None
+        self.max_pending = 2 * (processes or multiprocessing.cpu_count())
+        self.pending = deque()
+        self.closed = False
+        self.first_frame = first_frame
+        self.num_frames = 0
+        self.seq = 0
+        self.outfp = open(filename, 'wb') if apng else None
+        self.actl_pos = None
+
+    def write(self, frame):
+        if self.pool is None:
+            self.write_encoded(*encode_frame(frame, self.width, self.height,
+                                             self.pix_fmt, self.level))
+            return
+        # The video tee reuses frame's buffer once write() returns,
+        # so send the pool a copy
+        self.pending.append(self.pool.apply_async(
+            encode_frame,
+            (bytes(frame), self.width, self.height, self.pix_fmt, self.level)
+        ))
+        while len(self.pending) > self.max_pending:
+            self.write_encoded(*self.pending.popleft().get())
+
+    def ihdr(self, colortype):
+        return png_chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height,
+                                              8, colortype, 0, 0, 0))
+
+    def write_encoded(self, colortype, data, plte):
+        if self.outfp is None:
+            with open(self.filename % (self.first_frame + self.num_frames),
+                      'wb') as outfp:
+                outfp.write(png_signature)
+                outfp.write(self.ihdr(colortype))
+                if plte:
+                    outfp.write(png_chunk(b'PLTE', plte))
+                outfp.write(png_chunk(b'IDAT', data))
+                outfp.write(png_chunk(b'IEND', b''))
+            self.num_frames += 1
+            return
+
+        outfp = self.outfp
+        if self.num_frames == 0:
+            outfp.write(png_signature)
+            outfp.write(self.ihdr(colortype))
+            # acTL holds the number of frames, which close() fills in
+            self.actl_pos = outfp.tell()
+            outfp.write(png_chunk(b'acTL', struct.pack('>II', 0, 0)))
+            if plte:
+                outfp.write(png_chunk(b'PLTE', plte))
+        outfp.write(png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self.seq, self.width, self.height, 0, 0,
+            1, self.fps, 0, 0
+        )))
+        self.seq += 1
+        if self.num_frames == 0:
+            outfp.write(png_chunk(b'IDAT', data))
+        else:
+            outfp.write(png_chunk(b'fdAT', struct.pack('>I', self.seq) + data))
+            self.seq += 1
+        self.num_frames += 1
+
+    def close(self):
+        """Wait for all frames to be encoded and finish the file."""
+        if self.closed:
+            return
+        self.closed = True
+        while self.pending:
+            self.write_encoded(*self.pending.popleft().get())
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.outfp:
+            if self.actl_pos is not None:
+                self.outfp.write(png_chunk(b'IEND', b''))
+                self.outfp.seek(self.actl_pos)
+                self.outfp.write(png_chunk(b'acTL', struct.pack('>II', self.num_frames, 0)))
+            self.outfp.close()
+            self.outfp = None
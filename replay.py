@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""
+Record controller input during play and render it to video offline.
+
+usage: replay.py [--pipe | --apng | --png] [-j JOBS] [-s START] FILE
+       replay.py --index OUTFILE [--interval FRAMES] FILE
+
+play_level() logs each frame's (vkeys, new_vkeys) to an InputLog,
+along with everything needed to start that level again: the map,
+the level's enemy list, the player's state at entry, and the seed
+for game.rng.  Replaying the log reproduces the same play, so the
+video and sound can be captured as fast as the CPU allows instead
+of at 60 Hz while someone plays.  A checksum of the game state
+after each frame is logged too, so a replay that drifts from the
+recording gets reported instead of silently rendering something
+else.
+
+With -j, the log is split into JOBS parts of about the same number
+of frames, and a pool of processes renders the parts at once.  The
+main process first plays the log without a display to take a
+snapshot of the game state where each part starts.  Each worker
+restores its snapshot and renders its part.  The main process then
+joins the video parts and renders the sound for the whole log.
+
+With --index, the log is saved as a SeekableLog with a snapshot of
+the game state every FRAMES frames.  Rendering a seekable log with
+-s or -j starts from these snapshots instead of playing the log
+from the beginning to reach each starting frame.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import struct, json, sys
+from array import array
+from bisect import bisect_right
+
+class InputLog(object):
+    """The controller input for each frame of one or more levels.
+
+segments is a list of (header, frames, checksums).  header is a
+dict describing the state at the start of a play_level() call,
+frames is a bytearray of vkeys, new_vkeys pairs, and checksums is
+an array of FHBGGame.state_checksum() after each frame.
+
+"""
+    magic = b'FHBGrec1'
+    seghead = struct.Struct('<III')
+
+    def __init__(self):
+        self.segments = []
+        self.frames = self.checksums = None
+
+    def begin_segment(self, game, level, mapentry, seed):
+        """Start logging a level.  Call before game.new_level()."""
+        p = game.player
+        mapname, mapstart, mapdata = mapentry or game.levelmaps[level[1]]
+        header = {
+            'seed': seed,
+            'level': list(level) if level else None,
+            'map': [mapname, mapstart, list(mapdata)],
+            'game': [game.cleared_levels, game.outer_x, game.outer_y,
+                     game.open_l, game.open_r],
+            'player': [list(p.pos), p.health, p.facing_left,
+                       p.mercy_time, p.walking_frame],
+        }
+        self.frames = bytearray()
+        self.checksums = array('I')
+        self.segments.append((header, self.frames, self.checksums))
+
+    def log(self, vkeys, new_vkeys, checksum):
+        self.frames.append(vkeys & 0xFF)
+        self.frames.append(new_vkeys & 0xFF)
+        self.checksums.append(checksum)
+
+    def num_frames(self):
+        return sum(len(frames) // 2 for (header, frames, c) in self.segments)
+
+    def save(self, filename):
+        with open(filename, 'wb') as outfp:
+            outfp.write(self.magic)
+            for header, frames, checksums in self.segments:
+                header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+                if sys.byteorder != 'little':
+                    checksums = array('I', checksums)
+                    checksums.byteswap()
+                checksums = checksums.tobytes()
+                outfp.write(self.seghead.pack(len(header), len(frames),
+                                              len(checksums)))
+                outfp.write(header)
+                outfp.write(frames)
+                outfp.write(checksums)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as infp:
+            data = infp.read()
+        if not data.startswith(cls.magic):
+            raise ValueError("%s: not an input log" % filename)
+        out = cls()
+        i = len(cls.magic)
+        while i < len(data):
+            headerlen, frameslen, checkslen = cls.seghead.unpack_from(data, i)
+            i += cls.seghead.size
+            header = json.loads(data[i:i + headerlen].decode('utf-8'))
+            i += headerlen
+            frames = bytearray(data[i:i + frameslen])
+            i += frameslen
+            checksums = array('I')
+            checksums.frombytes(data[i:i + checkslen])
+            if sys.byteorder != 'little':
+                checksums.byteswap()
+            i += checkslen
+            out.segments.append((header, frames, checksums))
+        return out
+
+def begin_replay_segment(game, header):
+    """Put game in the state a segment started in and load its level."""
+    p = game.player
+    (game.cleared_levels, game.outer_x, game.outer_y,
+     game.open_l, game.open_r) = header['game']
+    pos, p.health, p.facing_left, p.mercy_time, p.walking_frame = header['player']
+    p.pos = list(pos)
+    mapname, mapstart, mapdata = header['map']
+    mapentry = (mapname, tuple(mapstart) if mapstart else None,
+                bytearray(mapdata))
+    game.rng.seed(header['seed'])
+    game.new_level(header['level'], mapentry)
+
+def rle_frames(frames):
+    """Run-length encode a bytearray of vkeys, new_vkeys pairs.
+
+Each run of up to 256 identical pairs becomes 3 bytes: the run
+length minus 1, vkeys, and new_vkeys.  Held buttons make most
+pairs repeat, so this is typically 10 to 20 times smaller.
+
+"""
+    out = bytearray()
+    i, end = 0, len(frames)
+    while i < end:
+        vkeys, new_vkeys = frames[i], frames[i + 1]
+        j = i + 2
+        while (j < end and j - i < 512
+               and frames[j] == vkeys and frames[j + 1] == new_vkeys):
+            j += 2
+        out.extend(((j - i) // 2 - 1, vkeys, new_vkeys))
+        i = j
+    return out
+
+def unrle_frames(data):
+    """Undo rle_frames()."""
+    out = bytearray()
+    for i in range(0, len(data), 3):
+        out.extend(data[i + 1:i + 3] * (data[i] + 1))
+    return out
+
+class SeekableLog(object):
+    """An input log on disk that can be played from any frame.
+
+The file starts with a magic number and ends with a JSON index, the
+index's length as uint32, and the magic number again.  In between
+are, for each segment, the InputLog header as JSON, the frames as
+rle_frames(), and the checksums, then every interval frames, a
+keyframe: FHBGGame.snapshot() before that frame played.  Segments
+start with their own header, so keyframes are not stored there.
+
+The index is a dict:
+
+interval -- frames between keyframes
+segments -- [[offset, header length, frames length, checksums
+    length, number of frames], ...]
+keyframes -- [[frame, offset, length], ...], in order of frame
+
+seek() restores the keyframe at or before a frame and plays at most
+interval - 1 frames forward from there, so a reviewer can start
+anywhere in a long recording without playing it all from frame 0.
+
+"""
+    magic = b'FHBGskr1'
+    trailer = struct.Struct('<I8s')
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as infp:
+            if infp.read(len(self.magic)) != self.magic:
+                raise ValueError("%s: not a seekable input log" % filename)
+            infp.seek(-self.trailer.size, 2)
+            indexlen, magic = self.trailer.unpack(infp.read(self.trailer.size))
+            if magic != self.magic:
+                raise ValueError("%s: seekable input log is truncated" % filename)
+            infp.seek(-self.trailer.size - indexlen, 2)
+            index = json.loads(infp.read(indexlen).decode('utf-8'))
+        self.interval = index['interval']
+        self.seginfo = index['segments']
+        self.keyframes = index['keyframes']
+        self.keyframe_frames = [k[0] for k in self.keyframes]
+        self.segstarts = []
+        t = 0
+        for info in self.seginfo:
+            self.segstarts.append(t)
+            t += info[4]
+        self.total_frames = t
+        self.segcache = {}
+
+    @classmethod
+    def write(cls, filename, log, interval=600):
+        """Save an InputLog with a keyframe every interval frames.
+
+Taking the keyframes plays the whole log once without a display.
+
+"""
+        total = log.num_frames()
+        snapshots = take_snapshots(log, range(interval, total, interval))
+        segments, keyframes = [], []
+        with open(filename, 'wb') as outfp:
+            outfp.write(cls.magic)
+            t = 0
+            for header, frames, checksums in log.segments:
+                header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+                rle = rle_frames(frames)
+                if sys.byteorder != 'little':
+                    checksums = array('I', checksums)
+                    checksums.byteswap()
+                checksums = checksums.tobytes()
+                seglen = len(frames) // 2
+                segments.append([outfp.tell(), len(header), len(rle),
+                                 len(checksums), seglen])
+                outfp.write(header)
+                outfp.write(rle)
+                outfp.write(checksums)
+                for frame in range(t + 1, t + seglen):
+                    snapshot = snapshots.get(frame)
+                    if snapshot:
+                        keyframes.append([frame, outfp.tell(), len(snapshot)])
+                        outfp.write(snapshot)
+                t += seglen
+            index = json.dumps({
+                'interval': interval, 'segments': segments, 'keyframes': keyframes
+            }, separators=(',', ':')).encode('utf-8')
+            outfp.write(index)
+            outfp.write(cls.trailer.pack(len(index), cls.magic))
+
+    def read_at(self, offset, length):
+        with open(self.filename, 'rb') as infp:
+            infp.seek(offset)
+            return infp.read(length)
+
+    def num_frames(self):
+        return self.total_frames
+
+    def segment(self, segnum):
+        """Read a segment.  Return (header, frames, checksums)."""
+        try:
+            return self.segcache[segnum]
+        except KeyError:
+            pass
+        offset, headerlen, rlelen, checkslen, seglen = self.seginfo[segnum]
+        data = self.read_at(offset, headerlen + rlelen + checkslen)
+        header = json.loads(data[:headerlen].decode('utf-8'))
+        frames = unrle_frames(data[headerlen:headerlen + rlelen])
+        checksums = array('I')
+        checksums.frombytes(data[headerlen + rlelen:])
+        if sys.byteorder != 'little':
+            checksums.byteswap()
+        out = self.segcache[segnum] = (header, frames, checksums)
+        return out
+
+    def to_input_log(self):
+        """Read all segments into an InputLog."""
+        out = InputLog()
+        out.segments = [self.segment(i) for i in range(len(self.seginfo))]
+        return out
+
+    def seek(self, game, frame):
+        """Put game in its state just before frame plays.
+
+game must have had new_game() called.  Frames played to get there
+are drawn through game.view without flipping, and their sound
+effects are dropped.
+
+Return the segment number.
+
+"""
+        import chipsfx
+
+        if not 0 <= frame < self.total_frames:
+            raise IndexError("frame %d not in log of %d frames"
+                             % (frame, self.total_frames))
+        segnum = bisect_right(self.segstarts, frame) - 1
+        t = self.segstarts[segnum]
+        header, frames, checksums = self.segment(segnum)
+        k = bisect_right(self.keyframe_frames, frame) - 1
+        if k >= 0 and self.keyframe_frames[k] > t:
+            kframe, offset, length = self.keyframes[k]
+            game.restore(self.read_at(offset, length))
+        else:
+            kframe = t
+            begin_replay_segment(game, header)
+        for i in range(2 * (kframe - t), 2 * (frame - t), 2):
+            game.move(frames[i], frames[i + 1])
+            game.view.draw(game)
+        chipsfx.fxq_clear()
+        return segnum
+
+    def snapshot_at(self, frame):
+        """Return FHBGGame.snapshot() just before frame plays, or None
+if frame starts a segment."""
+        import fhbg
+        from headless import HeadlessView
+
+        if frame in self.segstarts:
+            return None
+        game = fhbg.FHBGGame(HeadlessView())
+        game.new_game()
+        self.seek(game, frame)
+        return game.snapshot()
+
+def is_seekable(filename):
+    with open(filename, 'rb') as infp:
+        return infp.read(len(SeekableLog.magic)) == SeekableLog.magic
+
+def load_log(filename):
+    """Load an InputLog or SeekableLog file as an InputLog."""
+    if is_seekable(filename):
+        return SeekableLog(filename).to_input_log()
+    return InputLog.load(filename)
+
+def replay_log(view, game, log, start=0, end=None, snapshot=None):
+    """Play back an InputLog through view without pacing.
+
+start, end -- the frames to show, counting from the first frame of
+    the log; frames of the same segment before start are played
+    without flipping, capturing, or logging sound effects
+snapshot -- FHBGGame.snapshot() after frame start - 1, to restore
+    instead of playing the frames before start
+
+Return a list of (segment, frame) where the game state first
+stopped matching the recording, one per segment that diverged.
+
+"""
+    import chipsfx
+
+    game.new_game()
+    game.pf.sheet = view.metatile_sheet
+    diverged = []
+    t = 0
+    if end is None:
+        end = log.num_frames()
+    for segnum, (header, frames, checksums) in enumerate(log.segments):
+        seglen = len(frames) // 2
+        if t + seglen <= start or t >= end:
+            t += seglen
+            continue
+        first = 0
+        if snapshot and t < start:
+            game.restore(snapshot)
+            first = 2 * (start - t)
+        else:
+            begin_replay_segment(game, header)
+        checking = len(checksums) > 0
+        for i in range(first, min(len(frames), 2 * (end - t)), 2):
+            game.move(frames[i], frames[i + 1])
+            to_update = view.draw(game)
+            if checking and game.state_checksum() != checksums[i // 2]:
+                diverged.append((segnum, i // 2))
+                checking = False
+            frame = t + i // 2
+            if frame < start:
+                chipsfx.fxq_clear()
+                continue
+            if frame == start:
+                # The screen missed the flips while catching up
+                view.display.num_frames = start
+                to_update = None
+            chipsfx.fxq_play(None, view.display.num_frames)
+            view.display.flip(to_update)
+        t += seglen
+    return diverged
+
+def split_log(log, num_parts, divisor=1):
+    """Split the frames of a log into about num_parts equal parts.
+
+Each part but the first starts on a multiple of divisor, so that a
+worker capturing every divisor-th frame captures the same frames
+as a single process would.
+
+Return a list of (start, end) frame numbers.
+
+"""
+    total = log.num_frames()
+    step = -(-total // max(1, num_parts))
+    step = max(divisor, -(-step // divisor) * divisor)
+    return [(start, min(total, start + step))
+            for start in range(0, total, step)]
+
+def take_snapshots(log, starts):
+    """Play a log without a display and snapshot the game at each start.
+
+Return a dict from each frame number in starts that is not the
+first frame of a segment to FHBGGame.snapshot() after the frame
+before it.
+
+"""
+    import chipsfx, fhbg
+    from headless import HeadlessView
+
+    starts = set(starts)
+    snapshots = {}
+    view = HeadlessView()
+    game = fhbg.FHBGGame(view)
+    game.new_game()
+    t = 0
+    for header, frames, checksums in log.segments:
+        seglen = len(frames) // 2
+        if not any(t < start < t + seglen for start in starts):
+            t += seglen
+            continue
+        begin_replay_segment(game, header)
+        for i in range(0, len(frames), 2):
+            if t + i // 2 in starts:
+                snapshots[t + i // 2] = game.snapshot()
+            game.move(frames[i], frames[i + 1])
+            view.draw(game)
+            chipsfx.fxq_clear()
+        t += seglen
+    return snapshots
+
+def render_part(job):
+    """Render frames start to end of a log in a worker process.
+
+job -- (log filename, start, end, capture divisor, with_png, snapshot)
+
+Video goes to vtee.raw.START, or if with_png, to PNG files named
+as if the whole log had been captured in one process.
+Return (diverged, logged sound effects).
+
+"""
+    import os
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame as G
+    import chipsfx, fhbg
+
+    filename, start, end, divisor, with_png, snapshot = job
+    log = load_log(filename)
+    # A pool may give one worker several parts
+    chipsfx.logged_fx[:] = []
+    fhbg.with_double = fhbg.with_fullscreen = False
+    fhbg.with_vidcap = False
+    G.display.init()
+    try:
+        view = fhbg.FHBGView()
+        game = fhbg.FHBGGame(view)
+        if with_png:
+            from pngenc import PNGWriter
+            w, h = view.display.get_surface().get_size()
+            outfp = PNGWriter('vtee%05d.png', w, h, 'rgb24', 60 // divisor,
+                              False, 0, first_frame=start // divisor)
+        else:
+            outfp = open('vtee.raw.%d' % start, 'wb')
+        view.display.set_videotee(outfp, divisor)
+        diverged = replay_log(view, game, log, start, end, snapshot)
+        view.display.close_videotee()
+        outfp.close()
+    finally:
+        G.quit()
+    return diverged, list(chipsfx.logged_fx)
+
+def render_parallel(filename, num_jobs, with_png=False, divisor=2):
+    """Render a log with a pool of num_jobs processes.
+
+Return (number of frames, diverged).
+
+"""
+    import os, multiprocessing, shutil
+    import chipsfx, fhbg
+
+    log = load_log(filename)
+    parts = split_log(log, num_jobs, divisor)
+    starts = [start for (start, end) in parts]
+    if is_seekable(filename):
+        seekable = SeekableLog(filename)
+        snapshots = dict((start, seekable.snapshot_at(start)) for start in starts)
+    else:
+        snapshots = take_snapshots(log, starts)
+    log = None
+    pool = multiprocessing.Pool(num_jobs)
+    try:
+        results = pool.map(render_part, [(filename, start, end, divisor, with_png,
+                                          snapshots.get(start))
+                                         for (start, end) in parts])
+    finally:
+        pool.close()
+        pool.join()
+
+    if not with_png:
+        with open('vtee.raw', 'wb') as outfp:
+            for start, end in parts:
+                partname = 'vtee.raw.%d' % start
+                with open(partname, 'rb') as infp:
+                    shutil.copyfileobj(infp, outfp)
+                os.remove(partname)
+
+    diverged = []
+    for part_diverged, logged_fx in results:
+        diverged.extend(part_diverged)
+        chipsfx.logged_fx.extend(logged_fx)
+    num_frames = parts[-1][1] if parts else 0
+    chipsfx.render_logged_fx(fhbg.sfxdata, num_frames)
+    return num_frames, sorted(set(diverged))
+
+def main(argv=None):
+    import os, argparse
+    from time import perf_counter
+
+    parser = argparse.ArgumentParser(description="Render a recorded game to video.")
+    parser.add_argument('filename', help="input log saved by fhbg.py")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--pipe', action='store_true',
+                        help="send video through fhbg.vidcap_pipe_cmd instead of vtee.raw")
+    output.add_argument('--apng', action='store_true',
+                        help="encode video to vtee.png without an external encoder")
+    output.add_argument('--png', action='store_true',
+                        help="encode video to numbered PNG files vtee00000.png, ...")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="render in this many processes at once")
+    parser.add_argument('-s', '--start', type=int, default=0,
+                        help="render from this frame to the end")
+    parser.add_argument('--index', metavar='OUTFILE',
+                        help="save a seekable copy of the log instead of rendering")
+    parser.add_argument('--interval', type=int, default=600,
+                        help="frames between snapshots with --index (default 600)")
+    args = parser.parse_args(argv)
+    if args.jobs > 1 and (args.pipe or args.apng):
+        parser.error("-j works only with vtee.raw or --png")
+    if args.jobs > 1 and args.start:
+        parser.error("-j renders the whole log and can't be used with -s")
+    if args.index:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        log = load_log(args.filename)
+        SeekableLog.write(args.index, log, max(1, args.interval))
+        print("%s: %d frames, %d segments, %d bytes"
+              % (args.index, log.num_frames(), len(log.segments),
+                 os.path.getsize(args.index)))
+        return
+    if args.jobs > 1:
+        t = perf_counter()
+        num_frames, diverged = render_parallel(args.filename, args.jobs, args.png)
+        t = perf_counter() - t
+        print("Replayed %d frames in %.2f s (%.1fx real time) with %d jobs"
+              % (num_frames, t, num_frames / 60 / max(t, 1e-6), args.jobs))
+        for segnum, frame in diverged:
+            print("warning: segment %d diverged from the recording at frame %d"
+                  % (segnum, frame))
+        return
+    log = load_log(args.filename)
+    if not 0 <= args.start < log.num_frames():
+        parser.error("-s must be less than the log's %d frames" % log.num_frames())
+    snapshot = None
+    if args.start and is_seekable(args.filename):
+        snapshot = SeekableLog(args.filename).snapshot_at(args.start)
+
+    # Nobody watches an offline render, so skip the window and the
+    # 2x scaling
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame as G
+    import chipsfx, fhbg
+    fhbg.with_double = fhbg.with_fullscreen = False
+    fhbg.with_vidcap = ('pipe' if args.pipe else 'apng' if args.apng
+                        else 'png' if args.png else True)
+    G.display.init()
+    try:
+        view = fhbg.FHBGView()
+        game = fhbg.FHBGGame(view)
+        t = perf_counter()
+        diverged = replay_log(view, game, log, args.start, None, snapshot)
+        t = perf_counter() - t
+        # Line up the sound with the first rendered frame
+        view.display.num_frames -= args.start
+        chipsfx.logged_fx[:] = [(ft - args.start, fx)
+                                for (ft, fx) in chipsfx.logged_fx]
+        num_frames = view.display.num_frames
+        print("Replayed %d frames in %.2f s (%.1fx real time)"
+              % (num_frames, t, num_frames / 60 / max(t, 1e-6)))
+        for segnum, frame in diverged:
+            print("warning: segment %d diverged from the recording at frame %d"
+                  % (segnum, frame))
+        view.close()
+    finally:
+        G.quit()
+
+if __name__=='__main__':
+    main()
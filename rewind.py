@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Keep recent game states so that practice mode can run time backward.
+
+Consecutive snapshots from FHBGGame.snapshot() differ in only a few
+bytes: a handful of cells, the critters' positions and timers, and
+part of the RNG state.  So RewindBuffer keeps the newest snapshot
+whole and each older frame as the XOR of its snapshot with the next
+newer one, compressed with zlib, which is mostly runs of zeros.
+Every keyframe_interval frames, a whole compressed snapshot is kept
+instead, so that going back several frames at once need not undo
+every frame in between.  Stepping back one frame is one XOR and one
+decompression.
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+import zlib
+from collections import deque
+
+def xor_bytes(a, b):
+    """XOR two byte strings, padding the shorter with zeros."""
+    length = max(len(a), len(b))
+    x = int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')
+    return x.to_bytes(length, 'little')
+
+class RewindBuffer(object):
+    """The last max_frames snapshots of a game, in at most max_bytes.
+
+Call push() with each frame's snapshot and pop() to go back.  Once
+either limit is reached, the oldest frames are forgotten.
+
+"""
+    def __init__(self, max_frames=1800, max_bytes=4 << 20,
+                 keyframe_interval=60):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.keyframe_interval = keyframe_interval
+        self.clear()
+
+    def clear(self):
+        self.head = None
+        # Each entry is (is_keyframe, length, data) for one frame
+        # older than head, oldest first.  A keyframe's data is its
+        # compressed snapshot.  Other data is the compressed XOR of
+        # its snapshot with that of the frame after it.
+        self.entries = deque()
+        self.num_bytes = 0
+        self.frames_since_keyframe = 0
+
+    def __len__(self):
+        return len(self.entries) + (self.head is not None)
+
+    def push(self, snapshot):
+        """Add the snapshot of the newest frame."""
+        head = self.head
+        self.head = snapshot
+        if head is None:
+            return
+        self.frames_since_keyframe += 1
+        if self.frames_since_keyframe >= self.keyframe_interval:
+            self.frames_since_keyframe = 0
+            entry = (True, len(head), zlib.compress(head, 1))
+        else:
+            entry = (False, len(head), zlib.compress(xor_bytes(head, snapshot), 1))
+        self.entries.append(entry)
+        self.num_bytes += len(entry[2])
+        while self.entries and (len(self.entries) >= self.max_frames
+                                or self.num_bytes > self.max_bytes):
+            self.num_bytes -= len(self.entries.popleft()[2])
+
+    def pop(self, num_frames=1):
+        """Forget the newest num_frames frames.
+
+Return the snapshot of the frame that is then newest, or None if
+there are no older frames.  That frame stays in the buffer, so the
+game can go on from it or go back further.
+
+"""
+        num_frames = min(num_frames, len(self.entries))
+        if num_frames <= 0:
+            return None
+        entries = self.entries
+        target = len(entries) - num_frames
+
+        # Start from the nearest keyframe at or after target, if any
+        start = len(entries)
+        snapshot = self.head
+        for i in range(target, len(entries)):
+            if entries[i][0]:
+                start = i
+                snapshot = zlib.decompress(entries[i][2])
+                break
+        for i in range(start - 1, target - 1, -1):
+            is_keyframe, length, data = entries[i]
+            data = zlib.decompress(data)
+            snapshot = data if is_keyframe else xor_bytes(snapshot, data)[:length]
+
+        for i in range(num_frames):
+            self.num_bytes -= len(entries.pop()[2])
+        self.frames_since_keyframe = 0
+        for i in range(len(entries) - 1, -1, -1):
+            if entries[i][0]:
+                break
+            self.frames_since_keyframe += 1
+        self.head = snapshot
+        return snapshot
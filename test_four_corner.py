@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Check four_corner_collide() against the cascade it replaced.
+
+four_corner_collide() looks its push up in four_corner_table.
+reference_four_corner_collide() below is the if/elif cascade it was
+before the table, in the same 1/256 pixel units, and must give the
+same result, or fail its assertion, for every arrangement of solid
+cells and ladders, every position of the object's center within
+the cells, and both values of with_downsolid and diag_corner_push.
+The box sizes are those the critters use and a few tiny ones, which
+between them reach every entry of the table that any box can.
+
+Run with pytest or by itself:
+
+    python3 test_four_corner.py
+
+"""
+from __future__ import with_statement, division, print_function, unicode_literals
+from itertools import product
+from enemy import four_corner_collide, PX, TILE
+from loadlevel import MTF_BLOCK, MTF_LADDER, MTF_ELEVATOR_DOOR
+
+def reference_four_corner_collide(pf, x, y, rx, ry,
+                                  with_downsolid=True, diag_corner_push=False):
+    tlx = (x - 8 * PX) // TILE
+    tly = (y - 8 * PX) // TILE
+    dx = x - (tlx + 1) * TILE
+    dy = y - (tly + 1) * TILE
+    if dy >= 0:  # already below centerline
+        with_downsolid = False
+
+    # 1 2
+    # 4 8
+    rows = pf.flagrows
+    blks = 0
+    for (shift, y1) in ((0, tly), (2, tly + 1)):
+        if y1 < 0:
+            continue
+        y1 = min(y1, 11)
+        row = rows[MTF_BLOCK][y1] | rows[MTF_ELEVATOR_DOOR][y1]
+        if shift and with_downsolid:
+            row |= rows[MTF_LADDER][y1]
+        if tlx >= 0:
+            row = ((row << 32) | row) >> (tlx % 32)
+        else:
+            row = row << 1 if tlx == -1 else 0
+        blks |= (row & 0x03) << shift
+    if not blks:
+        return
+
+    if blks == 0x0F:
+        if dx < dy:
+            return (-TILE, 0) if dx < -dy else (0, TILE)
+        else:
+            return (0, -TILE) if dx < -dy else (TILE, 0)
+
+    # 0 1
+    # 2 3
+    insideblk = (1 if dx >= 0 else 0) | (2 if dy >= 0 else 0)
+    embedded = (1 << insideblk) & blks
+    if not embedded:
+        if dx <= -rx:
+            blks = (blks & 0x05)
+            blks |= (blks << 1)
+        elif dx >= rx:
+            blks = (blks & 0x0A)
+            blks |= (blks >> 1)
+        if dy <= -ry:
+            blks = (blks & 0x03)
+            blks |= (blks << 2)
+        elif dy >= ry:
+            blks = (blks & 0x0C)
+            blks |= (blks >> 2)
+        if not blks:
+            return
+
+    if blks == (8 >> insideblk):
+        if diag_corner_push:
+            blks = 15 ^ (1 << insideblk)
+        elif rx - abs(dx) <= ry - abs(dy):
+            blks |= 1 << (insideblk ^ 1)
+        else:
+            blks |= 1 << (insideblk ^ 2)
+
+    if blks in (1, 8, 9):
+        blks |= 4 if dx > dy else 2
+    elif blks in (2, 4, 6):
+        blks |= 1 if dx > -dy else 8
+    assert blks not in (0, 1, 2, 4, 6, 8, 9, 15)
+
+    pushx, pushy = 0, 0
+    if (blks & 0x05) == 0x05:
+        pushx = rx - dx
+    elif (blks & 0x0A) == 0x0A:
+        pushx = -rx - dx
+    if (blks & 0x03) == 0x03:
+        pushy = ry - dy
+    elif (blks & 0x0C) == 0x0C:
+        pushy = -ry - dy
+    assert pushx or pushy
+    return pushx, pushy
+
+class FlagRows(object):
+    """Just enough of a MetatilePlane for four_corner_collide()."""
+    def __init__(self):
+        self.flagrows = dict((flag, [0] * 12)
+                             for flag in (MTF_BLOCK, MTF_LADDER, MTF_ELEVATOR_DOOR))
+
+def _push_or_assert(fn, *args):
+    try:
+        return fn(*args)
+    except AssertionError:
+        return 'assert'
+
+# Each of the four cells at columns 4-5 and rows 4-5 is empty,
+# solid, or a ladder, which is solid only from above
+CELL_FLAGS = (None, MTF_BLOCK, MTF_LADDER)
+BOX_SIZES = ((0, 0), (1, 0), (0, 1), (1, 2), (2, 1), (4, 8), (7, 7), (8, 8))
+
+def compare_arrangement(cells, step=PX // 2):
+    """Compare both functions with an object centered anywhere that
+reads the 2x2 cells at columns 4-5 and rows 4-5.
+
+Return a list of (x, y, rx, ry, with_downsolid, diag_corner_push,
+expected, got) for each mismatch.
+
+"""
+    pf = FlagRows()
+    for i, flag in enumerate(cells):
+        if flag is not None:
+            pf.flagrows[flag][4 + (i >> 1)] |= 1 << (4 + (i & 1))
+    mismatches = []
+    # tlx and tly are 4 from 4.5 cells to just short of 5.5, which
+    # puts dx and dy anywhere from -8 pixels to just short of 8
+    span = range(4 * TILE + 8 * PX, 5 * TILE + 8 * PX, step)
+    for x, y in product(span, span):
+        for (rx, ry), downsolid, diag in product(BOX_SIZES, (False, True),
+                                                 (False, True)):
+            args = (pf, x, y, rx * PX, ry * PX, downsolid, diag)
+            expected = _push_or_assert(reference_four_corner_collide, *args)
+            got = _push_or_assert(four_corner_collide, *args)
+            if got != expected:
+                mismatches.append(args[1:] + (expected, got))
+    return mismatches
+
+def test_four_corner_table():
+    mismatches = []
+    for cells in product(CELL_FLAGS, repeat=4):
+        mismatches.extend((cells,) + m for m in compare_arrangement(cells))
+    assert not mismatches, mismatches[:10]
+
+if __name__ == '__main__':
+    test_four_corner_table()
+    print("four_corner_table matches the cascade")